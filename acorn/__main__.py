@@ -0,0 +1,214 @@
+# Command line interface.
+# python -m acorn                  starts the application;
+# python -m acorn batch [...] DIR  analyses all images in DIR;
+# python -m acorn search [...]     finds parameters which reproduce
+#                                  annotated images.
+
+import os
+import sys
+import json
+import argparse
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(prog='python -m acorn',
+                                     description='Acorn Image')
+    parser.add_argument('--defaults', nargs=2, action='append',
+                        default=[], metavar=('ASSAY', 'PARAMS'),
+                        help='json file with default parameters '
+                             'of the assay in the app')
+    parser.add_argument('--autosave', action='store_true',
+                        help='write rows of the app report to '
+                             'ASSAY_autosave_NNN.csv in the working '
+                             'directory as they are added')
+    parser.add_argument('--result-cache-mb', type=int, default=0,
+                        dest='app_result_cache_mb',
+                        help='keep results of the app in .acorn_cache '
+                             'of the working directory, MB '
+                             '(default: 0, no cache)')
+    commands = parser.add_subparsers(dest='command')
+    batch = commands.add_parser('batch',
+                                help='analyse all images in a folder')
+    batch.add_argument('path', help='folder with images')
+    batch.add_argument('--assay', required=True,
+                       choices=['wound', 'counter', 'confluent'])
+    batch.add_argument('--params', default=None,
+                       help='json file with analysis parameters')
+    batch.add_argument('--recursive', action='store_true',
+                       help='search images in subfolders')
+    batch.add_argument('--wd', default=None,
+                       help='working directory (default: path)')
+    batch.add_argument('--report', default='report.csv',
+                       help='report file name in working directory')
+    batch.add_argument('--resume', action='store_true',
+                       help='keep the report and skip images in it '
+                            'analysed with the same parameters')
+    batch.add_argument('--npz', action='store_true',
+                       help='also save the report as numpy columns (.npz)')
+    batch.add_argument('--save-images', action='store_true',
+                       help='save outlined images to working directory')
+    batch.add_argument('--objects', action='store_true',
+                       help='save tables of cells to working directory '
+                            '(counter)')
+    batch.add_argument('--stats-only', action='store_true',
+                       help='compute only the report, '
+                            'with less memory per worker')
+    batch.add_argument('--workers', type=int, default=None,
+                       help='number of worker processes')
+    batch.add_argument('--cache-mb', type=int, default=0,
+                       help='decoded images kept by each worker, MB')
+    batch.add_argument('--result-cache-mb', type=int, default=0,
+                       help='keep results in .acorn_cache of the working '
+                            'directory, MB (default: 0, no cache)')
+    batch.add_argument('--tile-size', type=int, default=None,
+                       help='analyse very large images in tiles of this '
+                            'size, pixels; .npy images are also analysed')
+    search = commands.add_parser('search',
+                                 help='find parameters which reproduce '
+                                      'reference masks or counts')
+    search.add_argument('references',
+                        help='json file: {image: mask file or manual '
+                             'measurement}, paths relative to the file')
+    search.add_argument('grid',
+                        help='json file: {parameter: [values]}')
+    search.add_argument('--assay', required=True,
+                        choices=['wound', 'counter', 'confluent'])
+    search.add_argument('--params', default=None,
+                        help='json file with parameters not searched')
+    search.add_argument('--random', type=int, default=None,
+                        help='number of random combinations '
+                             '(default: all combinations)')
+    search.add_argument('--seed', type=int, default=None,
+                        help='seed of random search')
+    search.add_argument('--workers', type=int, default=None,
+                        help='number of worker processes')
+    search.add_argument('--top', type=int, default=5,
+                        help='number of printed results')
+    search.add_argument('--output', default=None,
+                        help='json file for the best parameters')
+    return parser
+
+
+def read_params(filename):
+    if filename is None:
+        return dict()
+    with open(filename) as f:
+        return json.load(f)
+
+
+def run_batch(args):
+    from .batch import BatchAnalysis, find_images, make_parameters
+    from .batch import tiling_problem, TILED_EXT
+    from .models import AppModel
+    from .report import ReportWriter
+    from .cache import RESULT_CACHE_FOLDER
+    wd = args.wd or args.path
+    params = make_parameters(args.assay, read_params(args.params))
+    tile_size = args.tile_size
+    problem = tiling_problem(params) if tile_size else None
+    if problem:
+        print('Warning: {}, images are analysed as a whole'.format(problem))
+        tile_size = None
+    img_ext = AppModel()()['img_ext']
+    if tile_size:
+        img_ext = img_ext + list(TILED_EXT)
+    paths = find_images(args.path, img_ext, recursive=args.recursive)
+    n_decoded = sum(not p.lower().endswith(TILED_EXT) for p in paths)
+    if tile_size and n_decoded:
+        print('Warning: {} images are not .npy files, they are decoded '
+              'as a whole before tiling'.format(n_decoded))
+    if len(paths) == 0:
+        print('No images found in {}'.format(args.path))
+        return 1
+    result_cache = None
+    if args.result_cache_mb > 0:
+        result_cache = os.path.join(wd, RESULT_CACHE_FOLDER)
+    batch = BatchAnalysis(args.assay, params,
+                          max_workers=args.workers,
+                          save_folder=wd if args.save_images else None,
+                          cache_bytes=args.cache_mb*2**20,
+                          table_folder=wd if args.objects else None,
+                          stats_only=args.stats_only,
+                          result_cache=result_cache,
+                          result_cache_bytes=args.result_cache_mb*2**20,
+                          tile_size=tile_size)
+    # Rows are written as images are finished, so the report
+    # of an interrupted run is kept and can be resumed
+    report = ReportWriter(os.path.join(wd, args.report),
+                          resume=args.resume, npz=args.npz)
+    n_found = len(paths)
+    paths = [p for p in paths if not report.contains(p, batch.params)]
+    if len(paths) < n_found:
+        print('{} images are already in the report'.format(
+            n_found - len(paths)))
+    n_files = len(paths)
+    counter = [0]
+    # Finished rows wait for the rows of the images before them,
+    # so the report is in the order of the images
+    indices = {path: index for index, path in enumerate(paths)}
+    finished = dict()
+    next_index = [0]
+
+    def progress(path, row, error):
+        counter[0] += 1
+        finished[indices[path]] = row
+        while next_index[0] in finished:
+            row = finished.pop(next_index[0])
+            next_index[0] += 1
+            if row is not None:
+                report.append(row)
+        status = 'error: {}'.format(error) if error else 'done'
+        print('{} out of {}: {} {}'.format(counter[0], n_files,
+                                           path, status))
+
+    with report:
+        batch(paths, callback=progress)
+    return 1 if batch.errors else 0
+
+
+def run_search(args):
+    from .tuning import ParameterSearch, save_parameters
+    folder = os.path.dirname(os.path.abspath(args.references))
+    references = dict()
+    for img_path, reference in read_params(args.references).items():
+        if isinstance(reference, str):
+            reference = os.path.join(folder, reference)
+        references[os.path.join(folder, img_path)] = reference
+    search = ParameterSearch(args.assay, references,
+                             read_params(args.grid),
+                             read_params(args.params),
+                             n_random=args.random, seed=args.seed,
+                             max_workers=args.workers)
+    for result in search(n_best=args.top):
+        print('{:.4f} {}'.format(result['error'], result['params']))
+    if args.output:
+        save_parameters(search.best(), args.output)
+    return 0
+
+
+def main(argv=None):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    if args.command == 'batch':
+        if args.tile_size and (args.save_images or args.objects):
+            parser.error('tiled images are analysed without '
+                         '--save-images and --objects')
+        return run_batch(args)
+    if args.command == 'search':
+        return run_search(args)
+    from .tuning import set_model_defaults
+    for assay, filename in args.defaults:
+        set_model_defaults(assay, read_params(filename))
+    from .button_commands_common import CommonButtonCommands
+    CommonButtonCommands.autosave = args.autosave
+    if args.app_result_cache_mb > 0:
+        CommonButtonCommands.result_cache_bytes = \
+            args.app_result_cache_mb*2**20
+    from .main_view import AcornImage
+    root = AcornImage()
+    root.mainloop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
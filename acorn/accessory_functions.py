@@ -3,8 +3,12 @@ import numpy as np
 import matplotlib.pyplot as plt 
 from matplotlib.colors import LinearSegmentedColormap
 from math import ceil
+from PIL import Image
+from scipy import ndimage as ndi
 import csv
+import io
 import os
+import threading
 
 
 def fig2array(fig):
@@ -18,32 +22,236 @@ def fig2array(fig):
     return arr  
 
 
+def plot_profile(values, thresh, width, height, out=None,
+                 color=(255, 0, 0), thresh_color=(0, 0, 255)):
+    """
+    Draws a line profile of values and a dotted threshold line
+    into an RGB array of height x width pixels.
+    out is reused if it has the right shape.
+    """
+    if out is None or out.shape != (height, width, 3):
+        out = np.empty((height, width, 3), dtype=np.uint8)
+    out.fill(255)
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    low = min(values.min(), thresh)
+    high = max(values.max(), thresh)
+    scale = (height - 1) / (high - low) if high > low else 0
+    # Values covered by every column of the plot, joined with
+    # the last value of the previous column to keep the line solid
+    starts = np.arange(width) * n // width
+    col_min = np.minimum.reduceat(values, starts)
+    col_max = np.maximum.reduceat(values, starts)
+    ends = np.append(starts[1:], n)
+    col_last = values[np.maximum(ends - 1, starts)]
+    col_min[1:] = np.minimum(col_min[1:], col_last[:-1])
+    col_max[1:] = np.maximum(col_max[1:], col_last[:-1])
+    top = np.round((high - col_max) * scale)
+    bottom = np.round((high - col_min) * scale)
+    rows = np.arange(height)[:, np.newaxis]
+    out[(rows >= top) & (rows <= bottom)] = color
+    thresh_row = int(round((high - thresh) * scale))
+    dots = (np.arange(width) // 3) % 2 == 0
+    out[thresh_row, dots] = thresh_color
+    return out
+
+
 def get_threshold(img, threshold_fun, offset_perc=0, **kwargs):
     """
     Gets threshold for image using threshold function.
     Offset should be provided as percentage value.
     """
-    data_type = str(img.dtype)
+    offset = threshold_offset(img.dtype, offset_perc)
+    if len(kwargs) > 0:
+        return threshold_fun(img, **kwargs) + offset
+    return threshold_fun(img) + offset
+
+
+def threshold_offset(dtype, offset_perc):
+    """
+    Converts offset from percents to units of the image data type.
+    """
+    data_type = str(dtype)
     if data_type == 'bool' or data_type.startswith('float'):
-        offset = offset_perc / 100
+        return offset_perc / 100
     elif data_type.startswith('uint'):
         fact = int(data_type.replace('uint', ''))
-        offset = int(round(offset_perc * 2**fact / 100))
+        return int(round(offset_perc * 2**fact / 100))
     else:
         raise ValueError('Incorrect data type of img: {}'.format(data_type))
-    if len(kwargs) > 0:
-        return threshold_fun(img, **kwargs) + offset
-    return threshold_fun(img) + offset
-    
 
-def save_image(img, path, color_map='gray'):
+
+class HistogramThreshold:
+    """
+    Computes Mean, Otsu and Minimum thresholds of an image
+    from its histogram, which is built once. Unsigned integer
+    images get one bin per intensity level, float images get
+    nbins bins between their minimum and maximum, as skimage
+    threshold functions do.
+    """
+
+    def __init__(self, img, nbins=256):
+        self.img = img
+        self.dtype = img.dtype
+        self.integer = str(self.dtype).startswith('uint')
+        self.cumulative = None
+        self.sorted = None
+        if self.integer:
+            counts = np.bincount(img.ravel())
+            levels = np.flatnonzero(counts)
+            first, last = levels[0], levels[-1] + 1
+            self.counts = counts[first:last]
+            self.centers = np.arange(first, last)
+            self.mean = np.dot(self.counts, self.centers) / img.size
+        else:
+            threshold_offset(self.dtype, 0) # checks data type
+            img = img.astype(float, copy=False)
+            low, high = img.min(), img.max()
+            self.counts, edges = np.histogram(img, bins=nbins,
+                                              range=(low, high))
+            self.centers = (edges[:-1] + edges[1:]) / 2
+            if low == high:
+                self.counts, self.centers = self.counts[:1], np.array([low])
+            self.mean = np.mean(img)
+        self.thresholds = dict()
+
+    @classmethod
+    def from_histogram(cls, counts, centers, mean, dtype):
+        """
+        Creates thresholds from a histogram accumulated elsewhere,
+        e.g. over the tiles of a large image. Integer histograms
+        have one bin per intensity level starting from zero.
+        percent_binary is not available for float histograms.
+        """
+        self = cls.__new__(cls)
+        self.img = None
+        self.dtype = np.dtype(dtype)
+        self.integer = str(self.dtype).startswith('uint')
+        self.cumulative = None
+        self.sorted = None
+        self.thresholds = dict()
+        counts = np.asarray(counts)
+        centers = np.asarray(centers)
+        if self.integer:
+            levels = np.flatnonzero(counts)
+            first, last = levels[0], levels[-1] + 1
+            counts, centers = counts[first:last], centers[first:last]
+        self.counts, self.centers, self.mean = counts, centers, mean
+        return self
+
+    def __call__(self, filt, offset_perc=0):
+        """
+        Returns threshold of filter ('Mean', 'Otsu' or 'Minimum')
+        shifted by offset given in percents.
+        """
+        if filt not in self.thresholds:
+            functions = {'Mean': self._mean,
+                         'Otsu': self._otsu,
+                         'Minimum': self._minimum}
+            if filt not in functions:
+                raise ValueError("There is no filter '{}'!".format(filt))
+            self.thresholds[filt] = functions[filt]()
+        return self.thresholds[filt] + threshold_offset(self.dtype,
+                                                        offset_perc)
+
+    def percent_binary(self, thresholds, below=False):
+        """
+        Returns percent of pixels above each of the thresholds
+        (below them if below is True), i.e. the area of binary
+        images for all thresholds at once. Integer images use
+        the cumulative histogram, float images are sorted once.
+        """
+        side = 'left' if below else 'right'
+        if self.integer:
+            if self.cumulative is None:
+                self.cumulative = np.append(0, np.cumsum(self.counts))
+            idx = np.searchsorted(self.centers, thresholds, side=side)
+            n_pixels = self.cumulative[idx]
+            n_total = self.cumulative[-1]
+        else:
+            if self.sorted is None:
+                self.sorted = np.sort(self.img, axis=None)
+            n_pixels = np.searchsorted(self.sorted, thresholds, side=side)
+            n_total = self.sorted.size
+        if not below:
+            n_pixels = n_total - n_pixels
+        return n_pixels * 100 / n_total
+
+    def _mean(self):
+        return self.mean
+
+    def _otsu(self):
+        if len(self.counts) == 1:
+            return self.centers[0]
+        counts = self.counts.astype(float)
+        weight1 = np.cumsum(counts)
+        weight2 = np.cumsum(counts[::-1])[::-1]
+        mean1 = np.cumsum(counts * self.centers) / weight1
+        mean2 = (np.cumsum((counts * self.centers)[::-1]) /
+                 weight2[::-1])[::-1]
+        variance12 = weight1[:-1] * weight2[1:] * (mean1[:-1] - mean2[1:])**2
+        return self.centers[np.argmax(variance12)]
+
+    def _minimum(self, max_iter=10000):
+        smooth = self.counts.astype(np.float64)
+        for counter in range(max_iter):
+            smooth = ndi.uniform_filter1d(smooth, 3)
+            maxima = self._local_maxima(smooth)
+            if len(maxima) < 3:
+                break
+        if len(maxima) != 2:
+            raise RuntimeError('Unable to find two maxima in histogram')
+        elif counter == max_iter - 1:
+            raise RuntimeError('Maximum iteration reached for histogram '
+                               'smoothing')
+        idx = np.argmin(smooth[maxima[0]:maxima[1] + 1])
+        return self.centers[maxima[0] + idx]
+
+    @staticmethod
+    def _local_maxima(hist):
+        """
+        Returns indices where the histogram starts to decrease
+        after an increase. Plateaus count as one maximum.
+        """
+        direction = np.sign(np.diff(hist))
+        changes = np.where(direction != 0, np.arange(len(direction)), -1)
+        last_change = np.maximum.accumulate(changes)[:-1]
+        # Direction before each step; increasing at the start
+        before = np.ones(len(direction))
+        before[1:] = np.where(last_change >= 0,
+                              direction[last_change], 1)
+        return np.flatnonzero((direction < 0) & (before > 0))
+
+
+def save_image(img, path, color_map='gray', jpeg_quality=75,
+               png_compression=6, lossless=False):
     """
-    Saves numpy images using matplotlib interface.
+    Saves numpy images with PIL. Two-dimensional images are scaled
+    to their range and colored by the matplotlib color map, as
+    plt.imsave does. lossless saves JPEG images with quality 100
+    and without chroma subsampling, the closest JPEG allows.
     """
     if len(img.shape) == 2:
-        plt.imsave(path, img, cmap=color_map)
+        img = img.astype(float)
+        low, high = np.min(img), np.max(img)
+        norm = np.zeros(img.shape)
+        if high > low:
+            norm = (img - low) / (high - low)
+        img = plt.get_cmap(color_map)(norm, bytes=True)
+    PILimg = Image.fromarray(np.ascontiguousarray(img))
+    ext = os.path.splitext(path)[-1].lower()
+    if ext in ('.jpg', '.jpeg'):
+        options = {'quality': jpeg_quality}
+        if lossless:
+            options = {'quality': 100, 'subsampling': 0}
+        PILimg = PILimg.convert('RGB')
+    elif ext == '.png':
+        options = {'compress_level': png_compression}
+        # plt.imsave writes PNG images with an alpha channel
+        PILimg = PILimg.convert('RGBA')
     else:
-        plt.imsave(path, img)
+        options = dict()
+    PILimg.save(path, **options)
 
 
 def generate_cmap(N):
@@ -83,20 +291,47 @@ def backend_switcher(fun):
     return switcher
    
    
+def format_row(row):
+    """
+    Returns a copy of the report row as it is written to csv files:
+    backslashes in file names and decimal commas in values.
+    """
+    formatted = dict()
+    for key, value in row.items():
+        if key == 'file':
+            formatted[key] = value.replace('/', '\\')
+        else:
+            formatted[key] = str(value).replace('.', ',')
+    return formatted
+
+
 def save_csv(table, fieldnames, filename):
     with open(filename, "w", newline="") as csvfile:
             writer = csv.DictWriter(csvfile, delimiter=";",
                                     fieldnames=fieldnames)
             writer.writeheader()
             for row in table:
-                for key in row.keys():
-                    if key == 'file':
-                        row[key] = row[key].replace('/', '\\')
-                    else:
-                        row[key] = str(row[key]).replace('.', ',')
-                writer.writerow(row)
+                writer.writerow(format_row(row))
        
        
+def save_columns(columns, filename):
+    """
+    Saves a table of numpy columns (dict of equal length arrays)
+    as save_csv saves report rows: ';' separated values with
+    decimal commas. Integer columns are written as integers,
+    float columns with two decimals.
+    """
+    names = list(columns)
+    values = [np.asarray(columns[name]) for name in names]
+    fmt = ['%d' if v.dtype.kind in 'biu' else '%.2f' for v in values]
+    buffer = io.StringIO()
+    np.savetxt(buffer, np.column_stack(values).astype(float),
+               fmt=fmt, delimiter=';', newline='\r\n',
+               header=';'.join(names), comments='')
+    with open(filename, 'w', newline='') as csvfile:
+        csvfile.write(buffer.getvalue().replace('.', ','))
+
+
 def read_csv(path, sep=';'):
     table = []
     with open(path, newline='') as csvfile:
@@ -106,19 +341,112 @@ def read_csv(path, sep=';'):
     return table
 
 
+class FileNameAllocator:
+    """
+    Gives free file names name_NNN.ext in the folder. Used numbers
+    are kept for every name and extension; the folder is scanned
+    again when its modification time changes, so files deleted or
+    made by other programs are seen. A name is reserved by creating
+    its file (O_EXCL), so threads and processes saving to the folder
+    never get the same name.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.lock = threading.Lock()
+        self._scan()
+
+    def _scan(self):
+        # The time is taken first, so changes during the scan
+        # are found by the next allocation
+        self.mtime = self._mtime()
+        self.used = dict()
+        # Lowest number which may be free for every name
+        self.next_num = dict()
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                key, num = self._parse(entry.name)
+                if key is not None:
+                    self.used.setdefault(key, set()).add(num)
+
+    def _mtime(self):
+        return os.stat(self.folder).st_mtime_ns
+
+    @staticmethod
+    def _parse(file_name):
+        stem, dot, ext = file_name.rpartition('.')
+        name, sep, num_str = stem.rpartition('_')
+        if not (dot and sep and num_str.isdecimal()):
+            return None, None
+        return (name, ext), int(num_str)
+
+    def __call__(self, name, ext, num=0):
+        """
+        Returns path of the new empty file with the lowest
+        free number from num.
+        """
+        key = (name, ext)
+        with self.lock:
+            if self._mtime() != self.mtime:
+                self._scan()
+            used = self.used.setdefault(key, set())
+            next_num = self.next_num.get(key, 0)
+            if num <= next_num:
+                num = next_num
+            while True:
+                while num in used:
+                    num += 1
+                used.add(num)
+                path = os.path.join(self.folder,
+                                    '{}_{:03d}.{}'.format(name, num, ext))
+                try:
+                    os.close(os.open(path,
+                                     os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                except FileExistsError:
+                    continue
+                break
+            if num == next_num:
+                while num in used:
+                    num += 1
+                self.next_num[key] = num
+            # The folder was changed by this file, which is known
+            self.mtime = self._mtime()
+            return path
+
+
+# Allocators of the folders
+name_allocators = dict()
+name_allocators_lock = threading.Lock()
+
+
+def name_allocator(folder):
+    folder = os.path.abspath(folder)
+    with name_allocators_lock:
+        if folder not in name_allocators:
+            name_allocators[folder] = FileNameAllocator(folder)
+        return name_allocators[folder]
+
+
+def remove_reserved(path):
+    """
+    Removes the file of a name given by file_namer when
+    its writing failed, so the name is free again.
+    """
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
 def file_namer(folder, prefix='', basename='file',
                suffix=None, num=0, ext=''):
-    num_str = str(num)
-    add = 3 - len(num_str)
-    if add > 0:
-        num_str = '0' * add + num_str
+    """
+    Returns a free name prefix+basename_suffix_NNN.ext in the folder.
+    The empty file is created, so the name is not given twice;
+    if it can't be written, remove_reserved frees the name.
+    """
     if suffix is None:
-        name = prefix + basename + '_' + num_str
-    else:
-        name = prefix + basename + '_' + suffix + '_' + num_str
-    proposed = os.path.join(folder, '.'.join([name, ext]))
-    if os.path.exists(proposed):
-        num += 1
-        return file_namer(folder, prefix, basename, suffix, num, ext)
+        name = prefix + basename
     else:
-        return proposed
+        name = prefix + basename + '_' + suffix
+    return name_allocator(folder)(name, ext, num)
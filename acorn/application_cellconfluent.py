@@ -14,6 +14,9 @@ class CellConfluentButtonCommands(CommonButtonCommands):
     Adds specific functionality to the buttons of Cell Confluent App.
     """
 
+    assay = 'confluent'
+    sweep_label = 'Cell Confluent'
+
     def _select_image(self, img_path):
         result = False
         if img_path:
@@ -26,18 +29,20 @@ class CellConfluentButtonCommands(CommonButtonCommands):
                 self.show_wait_window()
             input = self.get_input()
             self.image(**input)
-            stat = self.image.get_stat()
-            images = self.image.get_images()
-            stat_text = "Cell Confluent: " + str(round(stat, 1)) + '%'
-            self.set_image_row(images,
-                        subtitles=['', '', stat_text],
-                        img_mode=['P', 'RGB', 'RGB'])
+            self._show_results(self.image.get_stat(),
+                               self.image.get_images())
             self.set_widgets({'channel': self.image.channel})
             if not self.draw_progress:
                 self.destroy_wait_window()
             self.set_slider(50)
             self.grab_set()
 
+    def _show_results(self, stat, images):
+        stat_text = "Cell Confluent: " + str(round(stat, 1)) + '%'
+        self.set_image_row(images,
+                    subtitles=['', '', stat_text],
+                    img_mode=['P', 'RGB', 'RGB'])
+
 class CellConfluentAssay(CellConfluentButtonCommands, CellConfluentAssayView):
     """
     Merges App view and button's functions.
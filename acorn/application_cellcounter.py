@@ -14,6 +14,11 @@ class CellCounterButtonCommands(CommonButtonCommands):
     Adds specific functionality to the buttons of Wound Assay app.
     """
 
+    assay = 'counter'
+    # Counts of reduced images differ too much: thresholds of
+    # the resampled histogram and distances between cells change
+    preview_size = None
+
     def _select_image(self, img_path):
         result = False
         if img_path:
@@ -26,19 +31,54 @@ class CellCounterButtonCommands(CommonButtonCommands):
                 self.show_wait_window()
             app_input = self.get_input()
             self.image(**app_input)
-            stat = self.image.get_stat()
-            images = self.image.get_images()
-            n_obj = 'Number of objects:' + str(stat[0])
-            n_deb = 'Number of debris:' + str(stat[1])
-            n_cells = 'Number of cells:' + str(stat[2])
-            self.set_image_row(images,
-                        subtitles=[n_obj, n_deb, n_cells],
-                        img_mode=['P', 'P', 'RGB'])
+            self._show_results(self.image.get_stat(),
+                               self.image.get_images())
             self.set_widgets({'channel': self.image.binary_im.channel})
             if not self.draw_progress:
                 self.wait_window.destroy()
             self.grab_set()
 
+    def _image_saver(self, image):
+        # Object table is saved next to the outlined image
+        super()._image_saver(image)
+        if self.get_save_images_status():
+            basename = self.get_file_name(with_ext=False)
+            try:
+                image.save_object_table(folder=self.get_path_wd(),
+                                        prefix='',
+                                        basename=basename,
+                                        suffix=self.img_filename_suffix)
+            except OSError as e:
+                tkmessagebox.showerror('Error!', str(e), parent=self)
+                self.grab_set()
+
+    def _show_results(self, stat, images):
+        self.set_image_row(images,
+                    subtitles=self._subtitles(stat),
+                    img_mode=['P', 'P', 'RGB'])
+
+    @staticmethod
+    def _subtitles(stat):
+        n_obj = 'Number of objects:' + str(stat[0])
+        n_deb = 'Number of debris:' + str(stat[1])
+        n_cells = 'Number of cells:' + str(stat[2])
+        return [n_obj, n_deb, n_cells]
+
+    def _size_thresh_changed(self, *args):
+        """
+        Updates numbers of cells and debris while the size
+        threshold is changed, using the object-size histogram
+        of the last Apply. Images are updated by Apply.
+        """
+        if self.image is None or self.image.img_labeled is None:
+            return
+        try:
+            size_thresh = self.add_panel.widgets['size_thresh'].get()
+        except (tk.TclError, ValueError):
+            return
+        stat = self.image.count_objects(size_thresh)
+        self.image_row.configure_subtitles(self._subtitles(stat))
+
 class CellCounterApp(CellCounterButtonCommands, CellCounterView):
     """
     Merges App view and button's functions.
@@ -52,4 +92,8 @@ class CellCounterApp(CellCounterButtonCommands, CellCounterView):
                                 default_folder=default_folder,
                                 img_ext=img_ext,
                                 *args, **kwargs)
-        CellCounterButtonCommands.__init__(self)
\ No newline at end of file
+        CellCounterButtonCommands.__init__(self)
+        self.file_manager.widgets['preview'].widget.configure(
+            state='disabled')
+        size_thresh = self.add_panel.widgets['size_thresh']
+        size_thresh.var.trace_add('write', self._size_thresh_changed)
\ No newline at end of file
@@ -0,0 +1,430 @@
+# Headless batch analysis.
+# Runs the analyzers of image_analysis over a folder of images
+# in a pool of worker processes and collects report rows.
+
+import os
+import numpy as np
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from PIL import Image
+from matplotlib import use
+use("Agg")
+from .image_analysis import WoundImage, CellCounter, CellConfluent
+from .tiling import TiledWoundImage, TiledCellCounter, TiledCellConfluent
+from .models import AppModel
+from .models import ImageCorrectionWoundAssayModel, WoundParametersModel
+from .models import ImageCorrectionCellCounterModel, CellCounterModel
+from .models import ImageCorrectionCellConfluent, CellConfluentModel
+from .accessory_functions import save_csv
+from .cache import decoded_images, corrected_images
+from .cache import ResultCache, params_hash
+
+
+ANALYZERS = {'wound': WoundImage,
+             'counter': CellCounter,
+             'confluent': CellConfluent}
+
+# Analyzers of very large images (tile_size is given)
+TILED_ANALYZERS = {'wound': TiledWoundImage,
+                   'counter': TiledCellCounter,
+                   'confluent': TiledCellConfluent}
+
+# Extensions of images which are read in tiles
+TILED_EXT = ('.npy',)
+
+MODELS = {'wound': (ImageCorrectionWoundAssayModel,
+                    WoundParametersModel),
+          'counter': (ImageCorrectionCellCounterModel,
+                      CellCounterModel),
+          'confluent': (ImageCorrectionCellConfluent,
+                        CellConfluentModel)}
+
+SUFFIXES = {'wound': 'wound',
+            'counter': 'counter',
+            'confluent': 'confluent'}
+
+# Columns of get_report_stat() in the report
+STAT_COLUMNS = {'wound': ('wound_area', 'wound_width'),
+                'counter': ('N_objects', 'N_debris', 'N_cells',
+                            'mean_cell_size', 'sd_cell_size', 'confl'),
+                'confluent': ('confluent',)}
+
+# Assays which measure separate objects
+TABLE_ASSAYS = ('counter',)
+
+# App inputs which do not change results of Apply ALL
+VIEW_IGNORED = ('file', 'preview')
+
+
+def _check_assay(assay):
+    if assay not in ANALYZERS:
+        raise ValueError("There is no assay '{}'!".format(assay))
+
+
+def default_parameters(assay):
+    """
+    Collects default values of the app models of the assay.
+    Spinbox values are converted to float as the widgets do.
+    """
+    _check_assay(assay)
+    params = dict()
+    for model in MODELS[assay]:
+        for key, pars in model()().items():
+            params[key] = _widget_value(pars, pars['default'])
+    return params
+
+
+def make_parameters(assay, params=None):
+    """
+    Merges user parameters with the defaults of the assay.
+    """
+    _check_assay(assay)
+    schemes = dict()
+    for model in MODELS[assay]:
+        schemes = {**schemes, **model()()}
+    merged = default_parameters(assay)
+    for key, value in (params or dict()).items():
+        if key in schemes:
+            value = _widget_value(schemes[key], value)
+        merged[key] = value
+    return merged
+
+
+def analysis_parameters(assay, params):
+    """
+    Returns parameters of the app models: the parameters
+    which the statistics of the report depend on.
+    """
+    _check_assay(assay)
+    keys = set()
+    for model in MODELS[assay]:
+        keys.update(model()())
+    return {key: value for key, value in params.items() if key in keys}
+
+
+def result_key(assay, img_path, params, tile_size=None):
+    """
+    Returns key of the result of the image in ResultCache.
+    """
+    params = analysis_parameters(assay, params)
+    if tile_size:
+        # Tiled cell counts agree with the whole image within tolerance
+        params['tile_size'] = tile_size
+    return ResultCache.key(img_path, assay, params)
+
+
+def result_meta(image):
+    return {'called_with': image.called_with(),
+            'report_stat': image.get_report_stat(),
+            'stat': image.get_stat()}
+
+
+def cached_row(img_path, meta):
+    """
+    Returns report row of the image made from the cached result.
+    """
+    return {'file': img_path,
+            **meta['called_with'],
+            **meta['report_stat']}
+
+
+def _store_result(cache, key, meta, images=()):
+    try:
+        cache.put(key, meta, images)
+    except OSError:
+        # Results are computed again next time
+        pass
+
+
+def _widget_value(pars, value):
+    if pars['type'] == 'spinbox':
+        return float(value)
+    return value
+
+
+def find_images(path, img_ext=None, recursive=False):
+    """
+    Returns sorted absolute paths of the images in the folder.
+    """
+    img_ext = img_ext or AppModel()()['img_ext']
+    path = os.path.abspath(path)
+    images = list()
+    if recursive:
+        for folder, _, files in os.walk(path):
+            for f in files:
+                if os.path.splitext(f)[-1].lower() in img_ext:
+                    images.append(os.path.join(folder, f))
+    else:
+        for f in os.listdir(path):
+            if os.path.splitext(f)[-1].lower() in img_ext:
+                images.append(os.path.join(path, f))
+    return sorted(images)
+
+
+def _init_worker(cache_bytes):
+    decoded_images.set_budget(cache_bytes)
+    corrected_images.set_budget(cache_bytes)
+
+
+def tiling_problem(params):
+    """
+    Returns why images analysed with params cannot be tiled,
+    or None if they can.
+    """
+    if params.get('equal_exposure'):
+        return 'equal exposure is not available for tiled images'
+    return None
+
+
+def _analyse(assay, img_path, params, save_folder=None,
+             table_folder=None, stats_only=False, tile_size=None):
+    if tile_size:
+        # Every worker process analyses its tiles in one thread
+        image = TILED_ANALYZERS[assay](img_path, tile_size=tile_size,
+                                       max_workers=1)
+        image(**params)
+        return image
+    image = ANALYZERS[assay](img_path, stats_only=stats_only)
+    image(**params)
+    basename = os.path.splitext(os.path.basename(img_path))[0]
+    if save_folder:
+        image.save_final_image(folder=save_folder,
+                               prefix='',
+                               basename=basename,
+                               suffix=SUFFIXES[assay],
+                               ext='jpg')
+    if table_folder:
+        image.save_object_table(folder=table_folder,
+                                prefix='',
+                                basename=basename,
+                                suffix=SUFFIXES[assay])
+    return image
+
+
+def _report_row(image):
+    return cached_row(image.get_image_path(), result_meta(image))
+
+
+def _make_preview(img, res):
+    img = Image.fromarray(img).resize(res, Image.ANTIALIAS)
+    return np.asarray(img)
+
+
+def analyse_image(assay, img_path, params, save_folder=None,
+                  table_folder=None, stats_only=False,
+                  cache_folder=None, tile_size=None):
+    """
+    Analyses one image and returns its report row.
+    A result found in cache_folder is returned without the analysis,
+    unless images or tables have to be saved.
+    If tile_size is given, the image is analysed in tiles.
+    Runs inside the worker processes.
+    """
+    cached = None
+    if cache_folder:
+        cache = ResultCache(cache_folder)
+        key = result_key(assay, img_path, params, tile_size)
+        cached = cache.get(key)
+        if cached is not None and not (save_folder or table_folder):
+            return cached_row(img_path, cached[0])
+    image = _analyse(assay, img_path, params, save_folder,
+                     table_folder, stats_only, tile_size)
+    meta = result_meta(image)
+    if cache_folder and cached is None:
+        _store_result(cache, key, meta)
+    return cached_row(img_path, meta)
+
+
+def _view_key(params, res, view_res):
+    params = {key: value for key, value in params.items()
+              if key not in VIEW_IGNORED}
+    return params_hash([params, res, view_res])
+
+
+def analyse_preview(assay, img_path, params, save_folder=None,
+                    res=(300, 200), view_res=(360, 240),
+                    cache_folder=None, table_folder=None):
+    """
+    Analyses one image and returns its report row, statistics
+    and result images resized to the resolution of the app icons.
+    The resized images are kept in cache_folder with the result.
+    Runs inside the worker processes.
+    """
+    if cache_folder:
+        cache = ResultCache(cache_folder)
+        key = result_key(assay, img_path, params)
+        view = _view_key(params, res, view_res)
+        cached = cache.get(key)
+        if (cached is not None and not (save_folder or table_folder) and
+                cached[0].get('view') == view):
+            meta, images = cached
+            return {'row': cached_row(img_path, meta),
+                    'stat': meta['stat'],
+                    'images': images[:-1],
+                    'original': images[-1]}
+    image = _analyse(assay, img_path, params, save_folder, table_folder)
+    original = image.get_PILimg().resize(view_res, Image.ANTIALIAS)
+    meta = result_meta(image)
+    result = {'row': cached_row(img_path, meta),
+              'stat': meta['stat'],
+              'images': [_make_preview(img, res)
+                         for img in image.get_images(res)],
+              'original': np.asarray(original)}
+    if cache_folder:
+        _store_result(cache, key, {**meta, 'view': view},
+                      result['images'] + [result['original']])
+    return result
+
+
+class BatchAnalysis:
+    """
+    Analyses a list of images in a pool of worker processes.
+    Rows have the same columns as the rows of the app report.
+    cache_bytes limits decoded images kept by each worker; every
+    image is usually read once, so nothing is kept by default.
+    Tables of objects (cell counter) are saved to table_folder.
+    With stats_only run() computes only the report rows: images are
+    released as soon as they are used, so workers need less memory.
+    Results are kept in the result_cache folder (ResultCache) of at
+    most result_cache_bytes, so images analysed before with the same
+    parameters are not analysed again.
+    If tile_size is given, run() analyses images in tiles of
+    tile_size pixels (see tiling), which makes no images or tables;
+    images are analysed as a whole if the parameters cannot be tiled
+    (see tiling_problem).
+    """
+
+    def __init__(self, assay, params=None,
+                 max_workers=None, save_folder=None,
+                 cache_bytes=0, table_folder=None,
+                 stats_only=False, result_cache=None,
+                 result_cache_bytes=256*2**20, tile_size=None):
+        if table_folder and assay not in TABLE_ASSAYS:
+            raise ValueError("There is no object table "
+                             "for '{}'!".format(assay))
+        if stats_only and (save_folder or table_folder):
+            raise ValueError('Images and tables are not made '
+                             'in the stats only mode!')
+        if tile_size and (save_folder or table_folder):
+            raise ValueError('Images and tables are not made '
+                             'for tiled images!')
+        self.assay = assay
+        self.params = make_parameters(assay, params)
+        if tiling_problem(self.params):
+            tile_size = None
+        self.max_workers = max_workers
+        self.save_folder = save_folder
+        self.cache_bytes = cache_bytes
+        self.table_folder = table_folder
+        self.stats_only = stats_only
+        self.result_cache = result_cache
+        self.result_cache_bytes = result_cache_bytes
+        self.tile_size = tile_size
+        self.result = []
+        self.errors = []
+        self.executor = None
+        self.futures = []
+
+    def start(self, paths, callback, **preview):
+        """
+        Submits images to the pool and returns without waiting.
+        callback(index, result, error) is called from a pool thread
+        for each image; result is the output of analyse_preview.
+        """
+        self.executor = self._make_executor()
+        self.futures = []
+        for index, path in enumerate(paths):
+            future = self.executor.submit(analyse_preview, self.assay,
+                                          path, self.params,
+                                          self.save_folder,
+                                          cache_folder=self.result_cache,
+                                          table_folder=self.table_folder,
+                                          **preview)
+            future.add_done_callback(partial(self._done, index, callback))
+            self.futures.append(future)
+
+    @staticmethod
+    def _done(index, callback, future):
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is None:
+            callback(index, future.result(), None)
+        else:
+            callback(index, None, error)
+
+    def stop(self, cancel=False):
+        """
+        Shuts down the pool started by start(). If cancel is True,
+        images which are not analysed yet are dropped; returns
+        their indices. Images being analysed are finished.
+        """
+        cancelled = list()
+        if self.executor is not None:
+            if cancel:
+                cancelled = [index for index, future
+                             in enumerate(self.futures) if future.cancel()]
+            self.executor.shutdown(wait=False)
+            self.executor = None
+            self.evict_results()
+        return cancelled
+
+    def evict_results(self):
+        """
+        Limits the size of the result cache.
+        """
+        if self.result_cache:
+            ResultCache(self.result_cache,
+                        self.result_cache_bytes).evict()
+
+    def _make_executor(self):
+        return ProcessPoolExecutor(self.max_workers,
+                                   initializer=_init_worker,
+                                   initargs=(self.cache_bytes,))
+
+    def run(self, paths):
+        """
+        Yields (path, row, error) in the order images are finished.
+        Either row or error is None.
+        """
+        with self._make_executor() as executor:
+            futures = {executor.submit(analyse_image, self.assay,
+                                       path, self.params,
+                                       self.save_folder,
+                                       self.table_folder,
+                                       self.stats_only,
+                                       self.result_cache,
+                                       self.tile_size): path
+                       for path in paths}
+            try:
+                for future in as_completed(futures):
+                    path = futures[future]
+                    try:
+                        yield path, future.result(), None
+                    except Exception as e:
+                        yield path, None, e
+            finally:
+                self.evict_results()
+
+    def __call__(self, paths, callback=None):
+        """
+        Analyses all images and returns rows in the order of paths.
+        callback is called with (path, row, error) for each image.
+        """
+        rows = dict()
+        self.errors.clear()
+        for path, row, error in self.run(paths):
+            if error is None:
+                rows[path] = row
+            else:
+                self.errors.append((path, error))
+            if callback:
+                callback(path, row, error)
+        self.result = [rows[p] for p in paths if p in rows]
+        return self.result
+
+    def save_report(self, filename, fieldnames=None):
+        if len(self.result) > 0:
+            if fieldnames is None:
+                fieldnames = self.result[0].keys()
+            save_csv(self.result, fieldnames, filename)
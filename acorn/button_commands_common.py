@@ -1,35 +1,84 @@
 
-from .accessory_functions import backend_switcher, dict_identical
+import os
+import queue
+from .accessory_functions import backend_switcher
 from .views import TableView
-from .accessory_functions import save_csv
+from .accessory_functions import file_namer, remove_reserved
 from tkinter import filedialog
 import tkinter.messagebox as tkmessagebox
+from PIL import Image
 from .views_additional_properties import AdditionalPropertis
+from .views_offset_sweep import OffsetSweepView
+from .batch import BatchAnalysis, make_parameters, STAT_COLUMNS
+from .batch import TABLE_ASSAYS
+from .batch import result_key, result_meta, cached_row
+from .cache import ResultCache, RESULT_CACHE_FOLDER
+from .image_writer import ImageWriter
+from .report import Report, ReportWriter
 
 class CommonButtonCommands:
     """
     Adds basic functionality to the buttons of ButtonPanel.
     """
 
+    poll_interval = 50 # ms
+    # Prefetched images are also corrected with current parameters
+    precorrect = True
+    # Images are reduced to this size in the preview mode,
+    # None switches the preview mode off
+    preview_size = (1200, 800)
+    # Y axis label of the offset sweep, None if there is no sweep
+    sweep_label = None
+    # If True (python -m acorn --autosave), rows are also written to
+    # assay_autosave_NNN.csv in the working directory as soon as
+    # they are added to the report
+    autosave = False
+    # Results of Add to Report and Apply ALL are kept in
+    # RESULT_CACHE_FOLDER of the working directory if a size is set
+    # (python -m acorn --result-cache-mb N); None switches it off
+    result_cache_bytes = None
+
     def __init__(self):
         self.image = None
-        self.result = []
+        self.result = Report(STAT_COLUMNS[self.assay])
         self.draw_progress = False
+        self.batch = None
+        self.batch_queue = queue.Queue()
+        self.applied_input = None
+        # Saves result images without blocking Apply
+        self.image_writer = ImageWriter()
+        # The autosaved report is made by the first row
+        self.report_writer = None
 
     def _select_image(self, img_path, FUN):
         if img_path:
-            self.image = FUN(img_path)
-            file_name = self.get_input().get('file')
+            # The same image keeps its analyzer, so cached
+            # processing stages are reused by the next Apply.
+            app_input = self.get_input()
+            max_size = None
+            if app_input.get('preview') and self.preview_size:
+                max_size = self.preview_size
+            same_image = (isinstance(self.image, FUN) and
+                          self.image.get_image_path() == img_path and
+                          self.image.max_size == max_size)
+            if not same_image:
+                self.image = FUN(img_path, max_size=max_size)
+            self.applied_input = app_input
+            file_name = app_input.get('file')
             index = self.file_manager.images.index(file_name)
             self.file_manager.image_index = index
             self.set_image(self.image.get_PILimg())
+            correction = app_input if self.precorrect else None
+            self.file_manager.prefetch_next(correction, max_size)
             return True
         else:
             return False
 
     def _apply(self):
+        applied = False
         try:
             self._sub_apply()
+            applied = True
         except Exception as e:
             if hasattr(self, 'wait_window'):
                 self.destroy_wait_window()
@@ -38,19 +87,27 @@ class CommonButtonCommands:
             tkmessagebox.showerror('Error!', str(e), parent=self)
             self.grab_set()
         finally:
-            n_files = len(self.file_manager.images)
-            im_index = self.file_manager.image_index
-            if n_files > 1:
-                if im_index > 0:
-                    self.activate_previous()
-                else:
-                    self.deactivate_previous()
-                if im_index + 1 == n_files:
-                    self.deactivate_next()
-                else:
-                    self.activate_next()
+            self._configure_navigation()
             self.activate_view_images()
             self.activate_add_to_report()
+            # The sweep needs the stages of a successful Apply
+            if self.sweep_label and self.image is not None and applied:
+                self.activate_offset_sweep()
+            else:
+                self.deactivate_offset_sweep()
+
+    def _configure_navigation(self):
+        n_files = len(self.file_manager.images)
+        im_index = self.file_manager.image_index
+        if n_files > 1:
+            if im_index > 0:
+                self.activate_previous()
+            else:
+                self.deactivate_previous()
+            if im_index + 1 == n_files:
+                self.deactivate_next()
+            else:
+                self.activate_next()
 
     def _next(self):
         self.next_file()
@@ -60,50 +117,237 @@ class CommonButtonCommands:
         self.previous_file()
         self._apply()
         
-    def _image_saver(self):
+    def _image_saver(self, image):
         save = self.get_save_images_status()
         if save:
             basename = self.get_file_name(with_ext=False)
-            self.image.save_final_image(folder=self.get_path_wd(),
-                                prefix='',
-                                basename=basename,
-                                suffix=self.img_filename_suffix,
-                                ext='jpg')
+            try:
+                image.save_final_image(folder=self.get_path_wd(),
+                                    prefix='',
+                                    basename=basename,
+                                    suffix=self.img_filename_suffix,
+                                    ext='jpg',
+                                    writer=self.image_writer)
+            except OSError as e:
+                tkmessagebox.showerror('Error!', str(e), parent=self)
+                self.grab_set()
+
+    def _flush_images(self):
+        """
+        Waits for images queued by _image_saver and shows
+        errors of their writing.
+        """
+        try:
+            self.image_writer.flush()
+        except OSError as e:
+            tkmessagebox.showerror('Error!', str(e), parent=self)
+            self.grab_set()
 
         
     def _add_to_report(self):
         if self.image:
-            filename = {'file': self.image.get_image_path()}
-            arguments = self.image.called_with()
-            report_stat = self.image.get_report_stat()
-            row = {**filename,
-                   **arguments,
-                   **report_stat}
-            if len(self.result) == 0:
-                self.result.append(row)
-                self._image_saver()
-            if not dict_identical(row, self.result[-1]):
-                self.result.append(row)
-                self._image_saver()
+            img_path = self.image.get_image_path()
+            cache, key, cached = self._cached_result(img_path)
+            if cached is not None and not self.get_save_images_status():
+                # The full resolution analysis is not repeated
+                self._append_row(cached_row(img_path, cached[0]))
+            else:
+                image = self._full_resolution()
+                meta = result_meta(image)
+                if self._append_row(cached_row(img_path, meta)):
+                    self._image_saver(image)
+                if cache is not None and cached is None:
+                    self._store_result(cache, key, meta)
             self.activate_report_buttons()
             self.deactivate_add_to_report()
-    
+
+    def _result_cache_folder(self):
+        if self.result_cache_bytes is None:
+            return None
+        return os.path.join(self.get_path_wd(), RESULT_CACHE_FOLDER)
+
+    def _cached_result(self, img_path):
+        """
+        Returns the result cache, key of the last Apply
+        and its cached result or None.
+        """
+        folder = self._result_cache_folder()
+        if folder is None:
+            return None, None, None
+        cache = ResultCache(folder, self.result_cache_bytes)
+        try:
+            # Parameters are merged as BatchAnalysis does,
+            # so Apply ALL finds the same results
+            params = make_parameters(self.assay, self.applied_input)
+            key = result_key(self.assay, img_path, params)
+        except OSError:
+            return None, None, None
+        return cache, key, cache.get(key)
+
+    @staticmethod
+    def _store_result(cache, key, meta):
+        try:
+            cache.put(key, meta)
+            cache.evict()
+        except OSError:
+            # Results are computed again next time
+            pass
+
+    def _full_resolution(self):
+        """
+        Repeats the last Apply at full resolution if
+        it was done in the preview mode.
+        """
+        if self.image.max_size is None:
+            return self.image
+        self.show_wait_window()
+        try:
+            image = type(self.image)(self.image.get_image_path())
+            image(**self.applied_input)
+        finally:
+            self.destroy_wait_window()
+            self.grab_set()
+        return image
+
+    def _append_row(self, row):
+        # Rows already in the report are not added again
+        if self.result.append(row):
+            self._autosave(row)
+            return True
+        return False
+
+    def _autosave(self, row):
+        if not self.autosave:
+            return
+        try:
+            if self.report_writer is None:
+                filename = file_namer(self.get_path_wd(),
+                                      basename=self.assay,
+                                      suffix='autosave', ext='csv')
+                try:
+                    self.report_writer = ReportWriter(filename)
+                except OSError:
+                    remove_reserved(filename)
+                    raise
+            self.report_writer.append(row)
+        except (OSError, ValueError) as e:
+            # The report is still kept in the app
+            self.autosave = False
+            self._close_autosave()
+            tkmessagebox.showerror('Error!',
+                                   "Can't autosave the report: {}".format(e),
+                                   parent=self)
+            self.grab_set()
+
+    def _close_autosave(self):
+        if self.report_writer is not None:
+            try:
+                self.report_writer.close()
+            except OSError:
+                pass
+            self.report_writer = None
+
     def _apply_all(self):
+        """
+        Analyses all images in a pool of worker processes.
+        Results are passed back through batch_queue, which is
+        polled from the Tk main loop, so the app stays responsive.
+        """
         self.file_manager.set_first_image()
         self.n_files = len(self.file_manager.images)
         if self.n_files > 1:
             self.draw_progress = True
-            self.progress_widget()
-            for _ in range(self.n_files):
-                self._apply()
-                self._add_to_report()
-                self.update_progressbar()
-                self.next_file()
-            self.destroy_progressbar()
-            self.draw_porgress = False
+            self.image = None
+            self.deactivate_offset_sweep()
+            self.progress_widget(cancel=self._cancel_apply_all)
+            paths = [os.path.join(self.file_manager.path, f)
+                     for f in self.file_manager.images]
+            save_folder = table_folder = None
+            if self.get_save_images_status():
+                save_folder = self.get_path_wd()
+                # Tables of objects are saved next to the images
+                if self.assay in TABLE_ASSAYS:
+                    table_folder = save_folder
+            self.batch_results = dict()
+            self.batch_errors = []
+            self.next_row = 0
+            self.batch = BatchAnalysis(
+                self.assay, self.get_input(),
+                save_folder=save_folder,
+                table_folder=table_folder,
+                result_cache=self._result_cache_folder(),
+                result_cache_bytes=self.result_cache_bytes)
+            self.batch.start(paths, self._batch_callback,
+                             res=self.image_row.res,
+                             view_res=self.img_view.res)
+            self.after(self.poll_interval, self._poll_apply_all)
+
+    def _cancel_apply_all(self):
+        # Cancelled images are passed as images without results,
+        # so rows already made are still added in order
+        self.cancel_button.configure(state='disabled')
+        for index in self.batch.stop(cancel=True):
+            self.batch_queue.put((index, None, None))
+
+    def _batch_callback(self, index, result, error):
+        # Called from a thread of the pool.
+        self.batch_queue.put((index, result, error))
+
+    def _poll_apply_all(self):
+        while True:
+            try:
+                index, result, error = self.batch_queue.get_nowait()
+            except queue.Empty:
+                break
+            self.batch_results[index] = result
+            if error is not None:
+                file_name = self.file_manager.images[index]
+                self.batch_errors.append('{}: {}'.format(file_name, error))
+            self.update_progressbar()
+        self._stream_results()
+        if self.fc < self.n_files:
+            self.after(self.poll_interval, self._poll_apply_all)
+        else:
+            self._finish_apply_all()
+
+    def _stream_results(self):
+        # Rows are added to the report in the order of files.
+        while self.next_row in self.batch_results:
+            result = self.batch_results.pop(self.next_row)
+            self.file_manager.select_file(self.next_row)
+            if result is not None:
+                self._append_row(result['row'])
+                self.set_image(Image.fromarray(result['original']))
+                self._show_results(result['stat'], result['images'])
+            self.next_row += 1
+
+    def _finish_apply_all(self):
+        self.batch.stop()
+        if self.report_writer is not None:
+            try:
+                self.report_writer.flush()
+            except OSError:
+                self._close_autosave()
+        self.batch = None
+        self.destroy_progressbar()
+        self.draw_progress = False
+        if len(self.result) > 0:
+            self.activate_report_buttons()
+        self._configure_navigation()
+        self.deactivate_view_images()
+        self.deactivate_add_to_report()
+        if self.batch_errors:
+            tkmessagebox.showerror('Error!', '\n'.join(self.batch_errors),
+                                   parent=self)
+        self.grab_set()
+
+    def _show_results(self, stat, images):
+        pass
    
     def _clear_report(self):
         self.result.clear()
+        # The next row starts a new autosaved report
+        self._close_autosave()
         self.set_default_images()
         self.deactivate_report_buttons()
         self.deactivate_view_images()
@@ -130,10 +374,9 @@ class CommonButtonCommands:
                        'initialfile': fileName,
                        'title': title}
             csv_name = filedialog.asksaveasfilename(**options)
-            if fieldnames is None:
-                fieldnames = self.result[0].keys()
+            self._flush_images()
             if csv_name != '':
-                save_csv(self.result, fieldnames, csv_name)
+                self.result.save_csv(csv_name, fieldnames)
 
     def _add_prop(self):
         inp = self.get_input()
@@ -142,4 +385,20 @@ class CommonButtonCommands:
         for pr in props:
             props_dict[pr] = inp.get(pr)
         print(props_dict)
-        self.add_prop = AdditionalPropertis(self, **props_dict)
\ No newline at end of file
+        self.add_prop = AdditionalPropertis(self, **props_dict)
+
+    def _offset_sweep(self):
+        """
+        Shows the result of the last Apply for all offsets.
+        """
+        if self.image is not None and self.sweep_label:
+            try:
+                OffsetSweepView(self, self.assay,
+                                self.image.get_image_path(),
+                                self.image.called_with(),
+                                self.image.sweep_offsets,
+                                self.image.offset_sweep(),
+                                ylabel=self.sweep_label)
+            except Exception as e:
+                tkmessagebox.showerror('Error!', str(e), parent=self)
+                self.grab_set()
\ No newline at end of file
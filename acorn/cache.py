@@ -0,0 +1,292 @@
+import os
+import json
+import hashlib
+import zipfile
+import threading
+import numpy as np
+from PIL import Image
+from functools import lru_cache
+from collections import OrderedDict
+
+
+class StageCache:
+    """
+    Memoizes outputs of the processing stages of an image.
+    Every stage keeps its last 'depth' outputs together with
+    the keys they were computed for. The key of a stage should
+    contain the key of the stage it depends on, so a change of
+    upstream parameters invalidates all dependent stages.
+    """
+
+    def __init__(self, depth=1):
+        self.depth = depth
+        self.stages = dict()
+
+    def __call__(self, stage, key, fun, *args, **kwargs):
+        """
+        Returns output of the stage for the key. Calls
+        fun(*args, **kwargs) only if there is no cached output.
+        """
+        cached = self.stages.setdefault(stage, OrderedDict())
+        if key in cached:
+            cached.move_to_end(key)
+            return cached[key]
+        value = fun(*args, **kwargs)
+        cached[key] = value
+        while len(cached) > self.depth:
+            cached.popitem(last=False)
+        return value
+
+    def clear(self, stage=None):
+        if stage is None:
+            self.stages.clear()
+        else:
+            self.stages.pop(stage, None)
+
+
+class LRUCache:
+    """
+    Thread-safe cache of numpy images. Least recently used
+    values are dropped when their total size exceeds max_bytes.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.values = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns cached value or None.
+        """
+        with self.lock:
+            cached = self.values.get(key)
+            if cached is None:
+                return None
+            self.values.move_to_end(key)
+            return cached[0]
+
+    def put(self, key, value, nbytes):
+        with self.lock:
+            if key not in self.values:
+                self.values[key] = (value, nbytes)
+                self.nbytes += nbytes
+            self._evict()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.values
+
+    def _evict(self):
+        while self.nbytes > self.max_bytes and len(self.values) > 0:
+            _, (_, nbytes) = self.values.popitem(last=False)
+            self.nbytes -= nbytes
+
+    def set_budget(self, max_bytes):
+        with self.lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+            self.nbytes = 0
+
+
+def file_key(img_path):
+    """
+    Identifies an image file by its path, modification time and size,
+    so a changed file gets a new key.
+    """
+    st = os.stat(img_path)
+    return (os.path.abspath(img_path), st.st_mtime, st.st_size)
+
+
+class DecodedImageCache(LRUCache):
+    """
+    Keeps decoded images in memory, so moving between images
+    does not decode them again. Images reduced to max_size
+    are kept separately from full resolution images.
+    """
+
+    def __init__(self, max_bytes=1024*2**20):
+        super().__init__(max_bytes)
+
+    def __call__(self, img_path, max_size=None):
+        """
+        Returns PIL image and numpy array of the image file and
+        the scale of the image relative to the file (1 for full
+        resolution). The array is shared between callers and
+        must not be changed.
+        """
+        key = file_key(img_path) + (max_size,)
+        cached = self.get(key)
+        if cached is None:
+            cached = self._decode(img_path, max_size)
+            self.put(key, cached, cached[1].nbytes)
+        mode, img_original, scale = cached
+        return Image.fromarray(img_original, mode), img_original, scale
+
+    def __contains__(self, img_path):
+        # Full resolution image of the file
+        try:
+            key = file_key(img_path) + (None,)
+        except OSError:
+            return False
+        return super().__contains__(key)
+
+    @staticmethod
+    def _decode(img_path, max_size=None):
+        PILimg = Image.open(img_path)
+        scale = 1.0
+        if max_size:
+            width = PILimg.width
+            # JPEG images are decoded directly at a reduced scale
+            PILimg.draft(PILimg.mode, max_size)
+            PILimg.thumbnail(max_size, Image.ANTIALIAS)
+            scale = PILimg.width / width
+        img_original = np.asarray(PILimg)
+        img_original.setflags(write=False)
+        return PILimg.mode, img_original, scale
+
+
+# Decoded images shared by all analyzers of the process
+decoded_images = DecodedImageCache()
+# Corrected images keyed by file_key and correction parameters
+corrected_images = LRUCache(256*2**20)
+
+
+# Results of the analysis are saved to this folder of the working directory
+RESULT_CACHE_FOLDER = '.acorn_cache'
+# Results saved by other versions of the analysis are not used
+RESULT_VERSION = 1
+
+
+@lru_cache(maxsize=4096)
+def _content_hash(path, mtime, size):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(2**20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def content_hash(img_path):
+    """
+    Returns hash of the content of the file. The file is
+    read again only if its file_key has changed.
+    """
+    return _content_hash(*file_key(img_path))
+
+
+def _plain(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+def params_hash(params):
+    """
+    Returns hash of json serializable parameters, which
+    does not depend on the order of dict keys.
+    """
+    text = json.dumps(params, sort_keys=True, default=_plain)
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+class ResultCache:
+    """
+    Results of the analysis saved to a folder. Keys are made from
+    the content of the image file and the parameters, so renamed and
+    copied images are found too. Every result is a compressed .npz
+    file with json metadata and optional images. Least recently used
+    results are removed by evict() when their total size exceeds
+    max_bytes. Several processes can use the same folder.
+    """
+
+    ext = '.npz'
+
+    def __init__(self, folder, max_bytes=256*2**20):
+        self.folder = folder
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(img_path, assay, params):
+        return params_hash([RESULT_VERSION, assay,
+                            content_hash(img_path), params])
+
+    def _path(self, key):
+        return os.path.join(self.folder, key + self.ext)
+
+    def get(self, key):
+        """
+        Returns metadata and images of the result or None.
+        """
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                meta = json.loads(str(data['meta']))
+                images = [data['image_{}'.format(i)]
+                          for i in range(meta['n_images'])]
+            # Modification time orders results for evict()
+            os.utime(path)
+        except (OSError, ValueError, KeyError, EOFError,
+                zipfile.BadZipFile):
+            # Missing or damaged results are computed again
+            return None
+        return meta, images
+
+    def put(self, key, meta, images=()):
+        os.makedirs(self.folder, exist_ok=True)
+        meta = dict(meta, n_images=len(images))
+        arrays = {'image_{}'.format(i): img for i, img in enumerate(images)}
+        path = self._path(key)
+        # Readers see either the old or the whole new file
+        tmp_path = '{}.{}.{}.tmp'.format(path, os.getpid(),
+                                         threading.get_ident())
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.savez_compressed(f, meta=np.array(json.dumps(
+                    meta, default=_plain)), **arrays)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _entries(self):
+        entries = list()
+        try:
+            with os.scandir(self.folder) as it:
+                for entry in it:
+                    if entry.name.endswith(self.ext):
+                        st = entry.stat()
+                        entries.append((st.st_mtime, st.st_size,
+                                        entry.path))
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def evict(self):
+        """
+        Removes least recently used results until their
+        total size is at most max_bytes.
+        """
+        entries = sorted(self._entries())
+        nbytes = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if nbytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            nbytes -= size
+
+    def clear(self):
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
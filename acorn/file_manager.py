@@ -1,8 +1,58 @@
 
 import os
+import threading
 import tkinter as tk
 from tkinter import ttk
 from .accessory_functions import limit_text, save_image, file_namer
+from .accessory_functions import remove_reserved
+from .cache import decoded_images
+from .image_analysis import CorrectedImage
+
+
+class ImagePrefetcher:
+    """
+    Decodes images in a background thread before they are opened,
+    so they are found in the cache of decoded images.
+    If correction parameters are given, corrected images
+    are also prepared. max_size is passed to the analyzers
+    in the preview mode.
+    """
+
+    def __init__(self):
+        self.pending = list()
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def prefetch(self, paths, correction=None, max_size=None):
+        """
+        Replaces not yet loaded images by new paths.
+        """
+        with self.condition:
+            self.pending = [(path, correction, max_size)
+                            for path in paths]
+            self.condition.notify()
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while len(self.pending) == 0:
+                    self.condition.wait()
+                path, correction, max_size = self.pending.pop(0)
+            try:
+                self._load(path, correction, max_size)
+            except Exception:
+                # Errors are reported when the image is opened
+                pass
+
+    @staticmethod
+    def _load(path, correction, max_size):
+        if correction is None:
+            decoded_images(path, max_size)
+        else:
+            CorrectedImage(path, max_size)(**correction)
 
 
 class ImageFileMixin:
@@ -10,11 +60,14 @@ class ImageFileMixin:
     Adds functionality to file manager panel
     """
     
+    prefetch_count = 2
+
     def __init__(self, path, img_ext, *args,
                  recursive=False, **kwargs):
         self.path = path
         self.img_ext = img_ext
         self.recursive = recursive
+        self.prefetcher = ImagePrefetcher()
         self.images = list()
         self._find_images()
         self.image_index = 0
@@ -57,6 +110,15 @@ class ImageFileMixin:
         self.image_index -= 1
         self.current_image = self.images[self.image_index]
 
+    def prefetch_next(self, correction=None, max_size=None):
+        """
+        Starts loading of the images following the current one.
+        """
+        first = self.image_index + 1
+        names = self.images[first:first + self.prefetch_count]
+        paths = [os.path.join(self.path, name) for name in names]
+        self.prefetcher.prefetch(paths, correction, max_size)
+
     @staticmethod
     def _fext(filename):
         """Returns file extension"""
@@ -91,5 +153,9 @@ class ImageFileMixin:
     @staticmethod
     def save_image(img, folder, name, suffix, ext='jpg'):
         abs_path = file_namer(folder, basename=name, suffix=suffix, ext=ext)
-        save_image(img, abs_path)
+        try:
+            save_image(img, abs_path)
+        except Exception:
+            remove_reserved(abs_path)
+            raise
             
@@ -4,25 +4,34 @@ import matplotlib.pyplot as plt
 from PIL import Image, ImageEnhance
 from PIL.ImageOps import invert
 from PIL.ImageFilter import GaussianBlur
-from skimage.filters import threshold_otsu, threshold_mean, threshold_minimum
-from skimage.morphology import watershed, binary_opening, binary_closing
-from skimage.morphology import disk, remove_small_objects
+from skimage.morphology import watershed
 from scipy import ndimage as ndi
-from skimage.filters import sobel, roberts
+from skimage.filters import sobel
 from skimage.feature import corner_peaks
 from skimage.exposure import equalize_adapthist
 from .accessory_functions import *
+from .cache import StageCache, decoded_images, corrected_images, file_key
+from .morphology import closing, opening, disk_footprint, ComponentFilter
+from .overlay import outline, mask_boundaries, label_boundaries
 from math import floor
+from inspect import signature
 
 
 class CorrectedImage:
     """
     Loads image and performs its basic correction using
     PIL tools.
+    If max_size (width, height) is given, the image is reduced
+    to fit it. Sizes in pixels are given for the original image
+    and are rescaled for the reduced one.
+    If stats_only is True, only statistics are computed: images are
+    released as soon as they are used and output images are not made.
     """
     
-    def __init__(self, img_path):
+    def __init__(self, img_path, max_size=None, stats_only=False):
         self.img_path = img_path
+        self.max_size = max_size
+        self.stats_only = stats_only
         self.PILimg = None
         self.channel = None
         self.bright = None
@@ -31,9 +40,11 @@ class CorrectedImage:
         self.equal_exposure = None
         self.inverse = None
         self.img_corrected = None
+        self.stages = StageCache()
         try:
-            self.PILimg = Image.open(self.img_path)
-            self.img_original = np.asarray(self.PILimg)
+            self.file_key = file_key(self.img_path)
+            (self.PILimg, self.img_original,
+             self.scale) = decoded_images(self.img_path, max_size)
         except:
             raise TypeError("Can't open file {}\n".format(img_path))
         self.height = self.img_original.shape[0]
@@ -48,11 +59,31 @@ class CorrectedImage:
         self.blur_radius = blur_radius
         self.equal_exposure = equal_exposure
         self.inverse = inverse
-        self.img_corrected = np.asarray(
-            self._correct_img(self._get_channel()))
+        self.img_corrected, self.channel = self.stages(
+            'corrected', self._correction_key(), self._corrected)
+        if self.stats_only:
+            self.PILimg = None
+            self.img_original = None
+
+    def _correction_key(self):
+        return (self.channel, self.bright, self.contr,
+                self.blur_radius, self.equal_exposure, self.inverse)
+
+    def _corrected(self):
+        # Corrected images are shared with other analyzers
+        # and with the prefetcher of the file manager.
+        key = (self.file_key, self.max_size, self._correction_key())
+        cached = corrected_images.get(key)
+        if cached is not None:
+            return cached
+        img_corrected = np.asarray(self._correct_img(self._get_channel()))
         if self.equal_exposure:
-            img_eqaul = equalize_adapthist(self.img_corrected)*255
-            self.img_corrected = img_eqaul.astype('uint8')
+            img_eqaul = equalize_adapthist(img_corrected)*255
+            img_corrected = img_eqaul.astype('uint8')
+        img_corrected.setflags(write=False)
+        corrected_images.put(key, (img_corrected, self.channel),
+                             img_corrected.nbytes)
+        return img_corrected, self.channel
     
     def get_PILimg(self):
         return self.PILimg
@@ -93,8 +124,34 @@ class CorrectedImage:
         img = br.enhance(self.bright)
         ctr = ImageEnhance.Contrast(img)
         img = ctr.enhance(self.contr)
-        img = img.filter(GaussianBlur(self.blur_radius))
+        img = img.filter(GaussianBlur(self.scaled(self.blur_radius)))
         return img
+
+    def _release(self, *stages):
+        """
+        Drops outputs of the stages in the stats only mode.
+        """
+        if self.stats_only:
+            for stage in stages:
+                self.stages.clear(stage)
+
+    def scaled(self, size, power=1):
+        """
+        Converts size in pixels of the original image (power=1)
+        or area in pixels (power=2) to the analysed image.
+        """
+        return size * self.scale**power
+
+    def scaled_pixels(self, size):
+        """
+        Converts size in pixels of the original image to whole
+        pixels of the analysed image. Sizes of one pixel or more
+        are not reduced below one pixel.
+        """
+        pixels = int(round(self.scaled(size)))
+        if size >= 1:
+            return max(pixels, 1)
+        return pixels
         
     def show_correction(self):
         fig, (ax1, ax2) = plt.subplots(ncols=2, figsize=(8, 4),
@@ -135,8 +192,12 @@ class BinaryImage(CorrectedImage):
     'Contrast' - should be used for stained images.
     """
     
-    def __init__(self, img_path):
-        super().__init__(img_path)
+    slice_width = 300
+    # Offsets (%) of offset_sweep
+    sweep_offsets = np.arange(-50, 50.5, 0.5)
+
+    def __init__(self, img_path, max_size=None, stats_only=False):
+        super().__init__(img_path, max_size, stats_only)
         self.pre_binary = None
         self.img_binary = None
         self.thresh = None
@@ -149,28 +210,68 @@ class BinaryImage(CorrectedImage):
         self.filt = filt
         self.mode = mode
         self.offset = offset
-        if self.mode == 'Borders':
-            self.pre_binary = sobel(self.img_corrected)
-        elif self.mode == 'Contrast' or self.mode == 'Contrast-positive':
-            self.pre_binary = self.img_corrected
-        else:
-            raise ValueError("There is no mode '{}'!".format(self.mode))
-        self.thresh = get_threshold(self.pre_binary,
-                                    self._get_filter(),
-                                    offset)
-        if self.mode == 'Borders':
-            self.img_binary = self.pre_binary > self.thresh
-        elif self.mode == 'Contrast':
-            self.img_binary = self.pre_binary < self.thresh
-        elif self.mode == 'Contrast-positive':
-            self.img_binary = self.pre_binary > self.thresh
+        self.pre_binary = self._get_pre_binary(mode)
+        self.thresh, self.img_binary = self.binarize(filt, mode, offset)
         return self.img_binary
-    
-    def _get_filter(self):
-        d = {'Mean': threshold_mean,
-             'Otsu': threshold_otsu,
-             'Minimum': threshold_minimum}
-        return d.get(self.filt)
+
+    def binarize(self, filt, mode='Borders', offset=0):
+        """
+        Thresholds the already corrected image with another filter,
+        mode or offset. Binary image of the object is not changed.
+        Returns threshold and binary image.
+        """
+        pre_binary = self._get_pre_binary(mode)
+        return self.stages('binary', self._binary_key(filt, mode, offset),
+                           self._binary, pre_binary, filt, mode, offset)
+
+    def offset_sweep(self, offsets=None, filt=None, mode=None):
+        """
+        Returns area (%) of the binary image for every offset
+        without thresholding the image. Filter and mode of the
+        last call are used by default.
+        """
+        if offsets is None:
+            offsets = self.sweep_offsets
+        filt = filt or self.filt
+        mode = mode or self.mode
+        histogram = self._get_histogram(mode)
+        thresholds = [histogram(filt, offset) for offset in offsets]
+        return histogram.percent_binary(thresholds,
+                                        below=(mode == 'Contrast'))
+
+    def _get_pre_binary(self, mode):
+        return self.stages('pre_binary', self._pre_binary_key(mode),
+                           self._pre_binary, mode)
+
+    def _pre_binary_key(self, mode):
+        return (self._correction_key(), mode)
+
+    def _binary_key(self, filt, mode, offset):
+        return (self._pre_binary_key(mode), filt, offset)
+
+    def _pre_binary(self, mode):
+        if mode == 'Borders':
+            return sobel(self.img_corrected)
+        elif mode == 'Contrast' or mode == 'Contrast-positive':
+            return self.img_corrected
+        else:
+            raise ValueError("There is no mode '{}'!".format(mode))
+
+    def _binary(self, pre_binary, filt, mode, offset):
+        thresh = self._get_histogram(mode)(filt, offset)
+        if mode == 'Contrast':
+            img_binary = pre_binary < thresh
+        else:
+            img_binary = pre_binary > thresh
+        return thresh, img_binary
+
+    def _get_histogram(self, mode):
+        """
+        Histogram of the pre-binary image. Shared by all filters
+        and offsets, so changing them does not scan the image again.
+        """
+        return self.stages('histogram', self._pre_binary_key(mode),
+                           HistogramThreshold, self._get_pre_binary(mode))
     
     def show_binary(self):
         fig = plt.figure()
@@ -179,25 +280,42 @@ class BinaryImage(CorrectedImage):
         plt.show()
       
     def get_image_slice(self, position=50):
-        y_slice = int(self.height*position/100)
+        """
+        Plots the row of pre-binary image at position (% of height)
+        and the threshold. The plot is drawn at icon resolution and
+        kept until the binary image or the position is changed;
+        it is shared, so it is read-only.
+        """
+        key = (self._binary_key(self.filt, self.mode, self.offset),
+               position)
+        return self.stages('slice', key, self._image_slice, position)
+
+    def _image_slice(self, position):
+        y_slice = min(int(self.height*position/100), self.height - 1)
         im_slice = self.pre_binary[y_slice,]
-        x = np.arange(len(im_slice))
-        fig = plt.figure(figsize=plt.figaspect(self.height/self.width))
-        plt.plot(x, im_slice, color='red')
-        plt.axhline(y=self.thresh, linestyle=':', color='blue')
-        plt.margins(x=0, y=0)
-        plt.axis('off')
-        arr = fig2array(fig)
-        plt.close()
-        return arr
+        width = self.slice_width
+        height = max(int(round(width*self.height/self.width)), 1)
+        plot = plot_profile(im_slice, self.thresh, width, height)
+        plot.setflags(write=False)
+        return plot
 
     @staticmethod
     def img_saver(img, folder, prefix, basename, suffix, ext,
-                                color_map='gray'):
+                                color_map='gray', writer=None):
+        """
+        Saves the image at once or queues it to the ImageWriter.
+        """
         file_name = file_namer(folder=folder, prefix=prefix,
                                 basename=basename,
                                 suffix=suffix, ext=ext)
-        save_image(img, file_name, color_map)
+        try:
+            if writer is None:
+                save_image(img, file_name, color_map)
+            else:
+                writer.submit(img, file_name, color_map)
+        except Exception:
+            remove_reserved(file_name)
+            raise
         
     def called_with(self):
         d = {'filt': self.filt,
@@ -215,9 +333,10 @@ class WoundImage(BinaryImage):
     eliminate falsely recognized wound objects.
     """
 
-    def __init__(self, img_path):
-        super().__init__(img_path)
+    def __init__(self, img_path, max_size=None, stats_only=False):
+        super().__init__(img_path, max_size, stats_only)
         self.pixels = 0
+        self.wound_pixels = 0
         self.disk_radius = 1
         self.min_wound = 1
         self.min_objects = 1
@@ -233,34 +352,84 @@ class WoundImage(BinaryImage):
         self.min_objects = min_objects
         self.min_wound = min_wound
         self.disk_radius = int(self.disk_radius)
-        self.selem = disk(self.disk_radius)
-        self.img_binary = self._less_details()
-        self.pixels = np.prod(self.img_corrected.shape)
-        black_granule_size = round(self.pixels*self.min_wound/100)
+        self.border_size = border_size
+        self.border_color = border_color
+        self.selem_radius = self.scaled_pixels(self.disk_radius)
+        self.pixels = self.height * self.width
+        if self.stats_only:
+            self.img_corrected = self.pre_binary = None
+            self._release('corrected', 'pre_binary', 'histogram')
+        self.img_binary = self.stages('less_details', self._less_details_key(),
+                                      self._less_details)
+        self._release('binary')
+        if self.stats_only:
+            # Only the area of the wound is needed
+            components = self._components()
+            self.wound_pixels = components.area(*self._granule_sizes())
+            self.img_binary = None
+            self._release('less_details', 'components')
+        else:
+            self.img_binary = self.stages('grains', self._grains_key(),
+                                          self._grains)
+            self.wound_pixels = np.count_nonzero(self.img_binary)
+
+    def _less_details_key(self):
+        return (self._binary_key(self.filt, self.mode, self.offset),
+                self.disk_radius)
+
+    def _grains_key(self):
+        return (self._less_details_key(), self.min_objects, self.min_wound)
+
+    def _wound_key(self):
+        return (self._grains_key(), self.border_size, self.border_color)
+
+    def _granule_sizes(self):
         white_granule_size = round(self.pixels*self.min_objects/100)
-        # Removes objects inside the wound            
-        self.img_binary = self._remove_grains(self.img_binary,
-                            white_granule_size)
-        # Removes objects outside of the wound
-        self.img_binary = self._remove_grains(np.logical_not(self.img_binary),
-                            black_granule_size)
+        black_granule_size = round(self.pixels*self.min_wound/100)
+        return white_granule_size, black_granule_size
+
+    def _components(self):
+        # Components are labeled once for all min_objects and min_wound
+        return self.stages('components', self._less_details_key(),
+                           ComponentFilter, self.img_binary)
+
+    def _grains(self):
+        # Removes objects inside the wound and then
+        # objects outside of the wound
+        return self._components()(*self._granule_sizes())
+
+    @property
+    def img_wound(self):
+        """
+        Image with wound borders, made when it is first used.
+        """
+        return self._wound_image()
+
+    def _wound_image(self, size=None):
+        return self.stages('wound', (self._wound_key(), size),
+                           self._wound, size)
+
+    def _wound(self, size=None):
         # Makes wound borders
-        border = ndi.maximum_filter(sobel(self.img_binary), border_size)
-        if self.channel == 'BW':
-            self.img_wound = np.dstack((self.img_original,) * 3)
-        else:
-            self.img_wound = self.img_original.copy()
-        self.img_wound[border.nonzero()] = border_color
+        border_size = self.scaled(self.border_size)
+        if size is not None:
+            border_size *= size[0] / self.width
+        border_size = max(int(round(border_size)), 1)
+        return outline(self.img_original, mask_boundaries(self.img_binary),
+                       self.border_color, border_size, size)
         
+    def offset_sweep(self, offsets=None, filt=None, mode=None):
+        """
+        Returns wound area (%) for every offset before
+        morphological operations.
+        """
+        return 100 - super().offset_sweep(offsets, filt, mode)
+
     def _less_details(self):
         img = self.img_binary
-        img = binary_closing(img, self.selem)
-        img = binary_opening(img, self.selem)
+        img = closing(img, self.selem_radius)
+        img = opening(img, self.selem_radius)
         return img
-           
-    @staticmethod
-    def _remove_grains(img, size):
-        return remove_small_objects(img, min_size=size)
     
     def show_wound(self):
         fig = plt.figure()
@@ -269,8 +438,9 @@ class WoundImage(BinaryImage):
         plt.show()
         
     def get_stat(self):
-        area = np.sum(self.img_binary) * 100 / self.pixels
-        width = np.sum(self.img_binary) / self.height
+        area = self.wound_pixels * 100 / self.pixels
+        # Width in pixels of the original image
+        width = self.wound_pixels / self.height / self.scale
         return (area, width)
 
     def get_report_stat(self):
@@ -278,9 +448,14 @@ class WoundImage(BinaryImage):
         return {'wound_area': round(area, 2),
                 'wound_width': round(width, 2)}
     
-    def get_images(self):
+    def get_images(self, size=None):
+        """
+        Returns corrected image, slice plot and wound image.
+        If size (width, height) is given, the wound image
+        is rendered at this resolution.
+        """
         im_slice = self.get_image_slice()
-        return [self.img_corrected, im_slice, self.img_wound]
+        return [self.img_corrected, im_slice, self._wound_image(size)]
         
     def called_with(self):
         d = {'disk_radius': self.disk_radius,
@@ -306,28 +481,70 @@ class WoundImage(BinaryImage):
         plt.tight_layout()
         plt.show()
 
-    def save_final_image(self, folder, prefix, basename, suffix, ext):
+    def save_final_image(self, folder, prefix, basename, suffix, ext,
+                         writer=None):
         super().img_saver(self.img_wound, folder, prefix,
-                          basename, suffix, ext)
+                          basename, suffix, ext, writer=writer)
+
+
+# Relative threshold of the cell markers: the default
+# of corner_peaks of the installed skimage
+PEAKS_THRESHOLD_REL = signature(corner_peaks).parameters[
+    'threshold_rel'].default
+
+
+def peaks_threshold(low, high):
+    """
+    Returns the threshold of cell_peaks for an image
+    with the minimum low and the maximum high.
+    """
+    if PEAKS_THRESHOLD_REL is None:
+        return low
+    return max(low, PEAKS_THRESHOLD_REL * high)
+
+
+def cell_peaks(distance, min_distance, footprint, threshold=None):
+    """
+    Returns markers of the cells: peaks of the distance transform.
+    If threshold is given, it replaces the threshold which
+    corner_peaks finds from the image (see peaks_threshold).
+    """
+    if threshold is None:
+        return corner_peaks(distance, indices=False,
+                            min_distance=min_distance,
+                            footprint=footprint)
+    return corner_peaks(distance, indices=False,
+                        min_distance=min_distance,
+                        footprint=footprint,
+                        threshold_abs=threshold, threshold_rel=None)
 
 
 class CellCounter:
+
+    # Values used for parameters which are not set in __call__
+    defaults = {'binary_filter': 'Minimum',
+                'mask_filter': 'Otsu',
+                'offset_binary': 0,
+                'offset_mask': 0,
+                'min_dist': 0,
+                'disk_radius': 0,
+                'size_thresh': 0}
     
-    def __init__(self, img_path):
-        self.binary_filter = 'Minimum'
-        self.mask_filter = 'Otsu'
-        self.offset_binary = 0
-        self.offset_mask = 0
-        self.min_dist = 0
-        self.disk_radius = 0
-        self.size_thresh = 0
-        self.binary_im = BinaryImage(img_path)
+    def __init__(self, img_path, max_size=None, stats_only=False):
+        for key, value in self.defaults.items():
+            setattr(self, key, value)
+        self.binary_im = BinaryImage(img_path, max_size, stats_only)
+        self.max_size = max_size
+        self.stats_only = stats_only
+        self.scale = self.binary_im.scale
+        self.binary_im.stages.depth = 2 # binary and mask
+        self.stages = StageCache()
         self.size_thresh = 0
         self.img_binary = None
         self.img_binary_mask = None
+        self.thresh_mask = None
         self.img_labeled = None
-        self.img_cells = None
-        self.img_debris = None
+        self.labeled_key = None
         self.N_objects = 0
         self.N_cells = 0
         self.N_debris = 0
@@ -340,53 +557,143 @@ class CellCounter:
                  border_color=None,
                  **kwargs):
         self.channel = channel
-        self.binary_filter = binary_filter or self.binary_filter
-        self.mask_filter = mask_filter or self.mask_filter
-        self.offset_binary = offset_binary or self.offset_binary
-        self.offset_mask = offset_mask or self.offset_mask
-        self.min_dist = min_dist or self.min_dist
-        self.disk_radius = disk_radius or self.disk_radius
-        self.size_thresh = size_thresh or self.size_thresh
+        d = self.defaults
+        self.binary_filter = binary_filter or d['binary_filter']
+        self.mask_filter = mask_filter or d['mask_filter']
+        self.offset_binary = offset_binary or d['offset_binary']
+        self.offset_mask = offset_mask or d['offset_mask']
+        self.min_dist = min_dist or d['min_dist']
+        self.disk_radius = disk_radius or d['disk_radius']
+        self.size_thresh = size_thresh or d['size_thresh']
         self.border_size = border_size
         self.border_color = border_color
+        # The image is corrected once; both thresholds
+        # are applied to the same corrected image.
         self.img_binary = self.binary_im(
                                 channel=self.channel,
-                                filt=binary_filter,
+                                filt=self.binary_filter,
                                 mode='Contrast-positive',
                                 offset=self.offset_binary, **kwargs)
-        self.img_binary_mask = self.binary_im(
-                                channel=self.channel,
-                                filt=mask_filter,
+        self.thresh_mask, self.img_binary_mask = self.binary_im.binarize(
+                                filt=self.mask_filter,
                                 mode='Contrast-positive',
-                                offset=self.offset_mask, **kwargs)      
-        distance = ndi.distance_transform_edt(self.img_binary)
-        foot_print = disk(self.disk_radius)
-        peaks = corner_peaks(distance, indices=False,
-                             min_distance=int(self.min_dist),
-                             footprint=foot_print)
-        markers = ndi.label(peaks)[0]
-        self.img_labeled = watershed(-distance, markers,
-                                 mask=self.img_binary_mask,
-                                 watershed_line=True)
-        num, inv, self.size = np.unique(self.img_labeled,
-                                        return_inverse=True,
-                                        return_counts=True)
-        inv.shape = self.img_binary.shape
-        self.img_cells = self.img_labeled.copy()
-        self.img_cells[(self.size < self.size_thresh)[inv]] = 0
-        self.img_debris = (self.size < self.size_thresh)[inv]
+                                offset=self.offset_mask)
+        binary_key = self.binary_im._binary_key(self.binary_filter,
+                                                'Contrast-positive',
+                                                self.offset_binary)
+        mask_key = self.binary_im._binary_key(self.mask_filter,
+                                              'Contrast-positive',
+                                              self.offset_mask)
+        labeled_key = (binary_key, mask_key,
+                       self.min_dist, self.disk_radius)
+        self.labeled_key = labeled_key
+        if self.stats_only:
+            # Both binary images are made
+            self.binary_im.img_corrected = self.binary_im.pre_binary = None
+            self.binary_im._release('corrected', 'pre_binary', 'histogram')
+        self.img_labeled = self.stages('labeled', labeled_key,
+                                       self._watershed)
+        (self.label_sizes, num,
+         self.hist_sizes, self.hist_cumcounts) = self.stages(
+            'sizes', labeled_key, self._size_table)
+        self.size = self.label_sizes[num]
         self.N_objects = max(num)
-        self.N_cells = np.sum(self.size[1:] >= self.size_thresh)
+        self.reclassify(self.size_thresh)
+        if self.stats_only:
+            # Only the size table is needed
+            self.binary_im.stages.clear()
+            self.stages.clear('labeled')
+            self.binary_im.img_binary = None
+            self.img_binary = self.img_binary_mask = None
+            self.img_labeled = None
+
+    def _size_table(self):
+        """
+        Counts pixels of each label and builds the object-size
+        histogram used to classify objects without relabeling.
+        """
+        label_sizes = np.bincount(self.img_labeled.ravel())
+        num = np.flatnonzero(label_sizes)
+        hist_sizes, hist_counts = np.unique(label_sizes[num][1:],
+                                            return_counts=True)
+        hist_cumcounts = np.concatenate(([0], np.cumsum(hist_counts)))
+        return label_sizes, num, hist_sizes, hist_cumcounts
+
+    def reclassify(self, size_thresh):
+        """
+        Splits labeled objects into cells and debris using
+        a new size threshold. Watershed is not repeated.
+        """
+        self.size_thresh = size_thresh
+        self.N_cells = self.count_objects(self.size_thresh)[2]
         self.N_debris = self.N_objects - self.N_cells
 
+    def _classes_key(self):
+        return (self.labeled_key, self.size_thresh)
+
+    @property
+    def img_debris(self):
+        """
+        Mask of debris, made when it is first used.
+        """
+        return self.stages('debris', self._classes_key(), self._debris)
+
+    @property
+    def img_cells(self):
+        """
+        Labels of cells without debris, made when it is first used.
+        """
+        return self.stages('cells', self._classes_key(), self._cells)
+
+    def _debris(self):
+        size_thresh = self.binary_im.scaled(self.size_thresh, 2)
+        return (self.label_sizes < size_thresh)[self.img_labeled]
+
+    def _cells(self):
+        return np.where(self.img_debris, 0, self.img_labeled)
+
+    def count_objects(self, size_thresh):
+        """
+        Returns numbers of objects, debris and cells for a size
+        threshold using the object-size histogram only.
+        """
+        n_small = np.searchsorted(self.hist_sizes,
+                                  self.binary_im.scaled(size_thresh, 2))
+        n_cells = self.hist_cumcounts[-1] - self.hist_cumcounts[n_small]
+        return (self.N_objects, self.N_objects - n_cells, n_cells)
+
+    def get_size_histogram(self):
+        """
+        Returns sizes of objects and numbers of objects of each size.
+        Sizes are in pixels of the analysed image.
+        """
+        return self.hist_sizes, np.diff(self.hist_cumcounts)
+
+    def _watershed(self):
+        distance = ndi.distance_transform_edt(self.img_binary)
+        # Radius is rounded as in WoundImage, so the disk is centered
+        radius = max(1, self.binary_im.scaled_pixels(self.disk_radius))
+        foot_print = disk_footprint(radius)
+        peaks = cell_peaks(distance,
+                           self.binary_im.scaled_pixels(self.min_dist),
+                           foot_print)
+        markers = ndi.label(peaks)[0]
+        return watershed(-distance, markers,
+                         mask=self.img_binary_mask,
+                         watershed_line=True)
+
     def get_stat(self):
         return (self.N_objects, self.N_debris, self.N_cells)
 
     def get_additional_stat(self):
-        cell_size = self.size[1:][self.size[1:] >= self.size_thresh]
-        mean_cell_size = np.mean(cell_size)
-        sd_cell_size = np.std(cell_size)
-        confl = np.sum(self.img_cells > 0)/np.prod(self.img_cells.shape)
+        size_thresh = self.binary_im.scaled(self.size_thresh, 2)
+        # Sizes in pixels of the original image
+        cell_size = self.size[1:][self.size[1:] >= size_thresh]
+        mean_cell_size = np.mean(cell_size) / self.scale**2
+        sd_cell_size = np.std(cell_size) / self.scale**2
+        sizes = self.label_sizes[1:]
+        n_pixels = self.binary_im.height * self.binary_im.width
+        confl = np.sum(sizes[sizes >= size_thresh])/n_pixels
         return (mean_cell_size, sd_cell_size, confl*100)
     
     def get_report_stat(self):
@@ -398,6 +705,81 @@ class CellCounter:
             d[head] = st if st == int(st) else round(st, 2)
         return d
 
+    def _object_table(self):
+        """
+        Measures all labeled objects in a few passes over the pixels
+        of objects. Pixels are taken in raster order, so the first
+        and the last pixel of an object give its rows; the transposed
+        image gives its columns.
+        """
+        labels = self.img_labeled
+        n_labels = len(self.label_sizes)
+        idx = np.flatnonzero(labels)
+        objects = labels.ravel()[idx]
+        rows, cols = np.divmod(idx, labels.shape[1])
+        intensity = self.binary_im.img_corrected.ravel()[idx]
+        ids, first = np.unique(objects, return_index=True)
+        last = len(objects) - 1 - np.unique(objects[::-1],
+                                            return_index=True)[1]
+        table = {'label': ids,
+                 'area': self.label_sizes[ids],
+                 'centroid_row': np.bincount(objects, rows, n_labels)[ids],
+                 'centroid_col': np.bincount(objects, cols, n_labels)[ids],
+                 'min_row': rows[first],
+                 'max_row': rows[last] + 1}
+        table['centroid_row'] /= table['area']
+        table['centroid_col'] /= table['area']
+        idx_t = np.flatnonzero(labels.T)
+        objects_t = labels.T.ravel()[idx_t]
+        cols_t = idx_t // labels.shape[0]
+        first = np.unique(objects_t, return_index=True)[1]
+        last = len(objects_t) - 1 - np.unique(objects_t[::-1],
+                                              return_index=True)[1]
+        table['min_col'] = cols_t[first]
+        table['max_col'] = cols_t[last] + 1
+        table['integrated_intensity'] = np.bincount(
+            objects, intensity, n_labels)[ids].astype(np.int64)
+        return table
+
+    def get_object_table(self):
+        """
+        Returns table of labeled objects as dict of columns: label,
+        area, centroid, bounding box (max_row and max_col are
+        exclusive), equivalent diameter, mean and integrated
+        intensity of the corrected image and whether the object
+        is a cell. Sizes are given in pixels of the original image.
+        """
+        table = self.stages('objects', self.labeled_key,
+                            self._object_table)
+        area = table['area']
+        columns = {'label': table['label']}
+        for key, power in (('area', 2),
+                           ('centroid_row', 1), ('centroid_col', 1),
+                           ('min_row', 1), ('min_col', 1),
+                           ('max_row', 1), ('max_col', 1)):
+            columns[key] = table[key]
+            if self.scale != 1:
+                columns[key] = table[key] / self.scale**power
+        columns['equivalent_diameter'] = np.sqrt(columns['area'] * 4 / np.pi)
+        columns['mean_intensity'] = table['integrated_intensity'] / area
+        columns['integrated_intensity'] = table['integrated_intensity']
+        if self.scale != 1:
+            columns['integrated_intensity'] = (table['integrated_intensity'] /
+                                               self.scale**2)
+        size_thresh = self.binary_im.scaled(self.size_thresh, 2)
+        columns['cell'] = (area >= size_thresh).astype(np.uint8)
+        return columns
+
+    def save_object_table(self, folder, prefix, basename, suffix):
+        file_name = file_namer(folder=folder, prefix=prefix,
+                               basename=basename,
+                               suffix=suffix + '_objects', ext='csv')
+        try:
+            save_columns(self.get_object_table(), file_name)
+        except Exception:
+            remove_reserved(file_name)
+            raise
+
     def _auto_select_color(self):
         if self.channel == 'Green':
             return (255, 0, 0)
@@ -406,18 +788,26 @@ class CellCounter:
         else:
             return (0, 0, 255)
 
-    def get_outlined_cells(self):
-        img_outlined = self.binary_im.get_img_original()
-        if len(img_outlined.shape) == 2:
-            img_outlined = np.dstack((img_outlined,) * 3)
-        img_borders = roberts(self.img_cells) > 0
-        if self.border_size > 1:
-            img_borders = ndi.maximum_filter(img_borders, self.border_size)
-        img_outlined.setflags(write=True)
+    def get_outlined_cells(self, size=None):
+        """
+        Returns the image with outlined cells. If size
+        (width, height) is given, it is rendered at this resolution.
+        """
+        border_size = self.binary_im.scaled(self.border_size)
+        if size is not None:
+            border_size *= size[0] / self.binary_im.width
+        border_size = int(round(border_size))
         if not self.border_color:
             self.border_color = self._auto_select_color()
-        img_outlined[img_borders] = self.border_color
-        return img_outlined
+        # Kept for the view and the saver of the same image
+        key = (self._classes_key(), border_size, self.border_color, size)
+        return self.stages('outlined', key, self._outlined,
+                           border_size, size)
+
+    def _outlined(self, border_size, size):
+        return outline(self.binary_im.img_original,
+                       label_boundaries(self.img_cells),
+                       self.border_color, border_size, size)
 
     def called_with(self):
         binary_call = self.binary_im.called_with()
@@ -435,14 +825,16 @@ class CellCounter:
     def get_PILimg(self):
         return self.binary_im.PILimg
 
-    def get_images(self):
-        img_debris_bw = self.img_debris.astype(np.uint8) * 255
-        color_map = generate_cmap(self.N_objects + 1)
-        img_cells_color = color_map(self.img_cells) * 255
-        img_cells_color = img_cells_color.astype(np.uint8)
+    def get_images(self, size=None):
+        """
+        Returns corrected image, debris and outlined cells.
+        If size (width, height) is given, outlined cells
+        are rendered at this resolution.
+        """
+        img_debris_bw = self.img_debris.view(np.uint8) * 255
         return [self.binary_im.img_corrected,
                 img_debris_bw,
-                self.get_outlined_cells()]
+                self.get_outlined_cells(size)]
 
     def get_image_path(self):
         return self.binary_im.img_path
@@ -466,24 +858,42 @@ class CellCounter:
 
     @staticmethod
     def img_saver(img, folder, prefix, basename, suffix, ext,
-                                color_map='gray'):
+                                color_map='gray', writer=None):
+        """
+        Saves the image at once or queues it to the ImageWriter.
+        """
         file_name = file_namer(folder=folder, prefix=prefix,
                                 basename=basename,
                                 suffix=suffix, ext=ext)
-        save_image(img, file_name, color_map)
+        try:
+            if writer is None:
+                save_image(img, file_name, color_map)
+            else:
+                writer.submit(img, file_name, color_map)
+        except Exception:
+            remove_reserved(file_name)
+            raise
     
-    def save_final_image(self, folder, prefix, basename, suffix, ext):
+    def save_final_image(self, folder, prefix, basename, suffix, ext,
+                         writer=None):
         self.img_saver(self.get_outlined_cells(), folder, prefix,
-                                basename, suffix, ext)
+                                basename, suffix, ext, writer=writer)
 
 
 
 class CellConfluent(WoundImage):
 
     def get_stat(self):
-        confluent = 100 - np.sum(self.img_binary) * 100 / self.pixels
+        confluent = 100 - self.wound_pixels * 100 / self.pixels
         return confluent
 
+    def offset_sweep(self, offsets=None, filt=None, mode=None):
+        """
+        Returns confluence (%) for every offset before
+        morphological operations.
+        """
+        return BinaryImage.offset_sweep(self, offsets, filt, mode)
+
     def get_report_stat(self):
         confl = self.get_stat()
         return {'confluent': round(confl, 1)}
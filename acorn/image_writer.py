@@ -0,0 +1,83 @@
+# Background saving of result images.
+# Images are encoded by PIL in a small pool of threads, so the app
+# does not wait for encoding and the disk. At most max_pending images
+# wait to be written; submit blocks when there are more of them.
+
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from .accessory_functions import save_image, remove_reserved
+
+
+class ImageWriter:
+    """
+    Saves numpy images in background threads. Errors of the writes
+    are raised by check(), flush() and close(); files of the failed
+    writes are removed. Options are passed to save_image.
+    """
+
+    def __init__(self, max_workers=2, max_pending=8, jpeg_quality=75,
+                 png_compression=6, lossless=False):
+        self.options = {'jpeg_quality': jpeg_quality,
+                        'png_compression': png_compression,
+                        'lossless': lossless}
+        self.executor = ThreadPoolExecutor(max_workers)
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.lock = threading.Lock()
+        self.futures = set()
+        self.errors = list()
+
+    def submit(self, img, path, color_map='gray'):
+        """
+        Queues the image for saving to path and returns. The image
+        must not be changed until it is written.
+        """
+        self.check()
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(save_image, img, path,
+                                          color_map, **self.options)
+        except Exception:
+            self.slots.release()
+            raise
+        with self.lock:
+            self.futures.add(future)
+        future.add_done_callback(lambda f: self._done(f, path))
+
+    def _done(self, future, path):
+        with self.lock:
+            self.futures.discard(future)
+            error = future.exception()
+            if error is not None:
+                self.errors.append('{}: {}'.format(path, error))
+                remove_reserved(path)
+        self.slots.release()
+
+    def check(self):
+        """
+        Raises an error if some of the finished writes failed.
+        """
+        with self.lock:
+            errors, self.errors = self.errors, list()
+        if errors:
+            raise OSError("Can't save images:\n" + '\n'.join(errors))
+
+    def flush(self):
+        """
+        Waits until all queued images are written.
+        """
+        with self.lock:
+            futures = list(self.futures)
+        wait(futures)
+        self.check()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
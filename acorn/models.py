@@ -7,13 +7,33 @@ import os
 
 
 class Model:
+
+    # Defaults changed at run time (e.g. by parameter search),
+    # {model class name: {widget: value}}
+    user_defaults = dict()
     
     def __init__(self):
         self.model = dict()
         
     def __call__(self):
+        defaults = self.user_defaults.get(type(self).__name__, dict())
+        for widget, value in defaults.items():
+            if widget in self.model:
+                self.model[widget]['default'] = value
         return self.model
 
+    @classmethod
+    def set_defaults(cls, values):
+        """
+        Changes default values of the widgets of the model.
+        Values of other widgets are ignored.
+        """
+        widgets = cls().model
+        defaults = Model.user_defaults.setdefault(cls.__name__, dict())
+        for widget, value in values.items():
+            if widget in widgets:
+                defaults[widget] = value
+
     def add_value(self, widget, key, value):
         if isinstance(value, dict):
             self.model[widget] = {**self.model[widget],
@@ -42,6 +62,10 @@ class FileManagerModel(Model):
                     'type': 'checkbutton',
                     'text_label': 'Save images',
                     'default': False}
+        self.model['preview'] = {
+                    'type': 'checkbutton',
+                    'text_label': 'Fast preview',
+                    'default': False}
 
    
 class ImageCorrectionDefaultModel(Model):
@@ -0,0 +1,148 @@
+# Binary morphology with disk footprints.
+# Small disks are applied directly; for larger disks dilation and
+# erosion are found by thresholding the Euclidean distance transform,
+# which gives the same result at a cost independent of the radius.
+# ComponentFilter removes small objects and holes with one labeling.
+
+import numpy as np
+from functools import lru_cache
+from scipy import ndimage as ndi
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from skimage.morphology import binary_opening, binary_closing, disk
+
+
+# Disks of this radius or larger are processed with the distance
+# transform; it is faster from radius 7 (closing and opening of
+# 1040x1388 and 2000x3000 images)
+EDT_MIN_RADIUS = 7
+
+
+@lru_cache(maxsize=32)
+def disk_footprint(radius):
+    """
+    Returns disk footprint of the radius. Footprints are shared,
+    so they must not be changed.
+    """
+    footprint = disk(radius)
+    footprint.setflags(write=False)
+    return footprint
+
+
+def dilation(img, radius):
+    """
+    Binary dilation by disk(radius). Pixels outside
+    of the image are background.
+    """
+    if not img.any():
+        return np.zeros(img.shape, dtype=bool)
+    # Distance of every pixel to the nearest object pixel
+    return ndi.distance_transform_edt(np.logical_not(img)) <= radius
+
+
+def erosion(img, radius):
+    """
+    Binary erosion by disk(radius). Pixels outside
+    of the image are objects, as skimage assumes.
+    """
+    if img.all():
+        return np.ones(img.shape, dtype=bool)
+    # Distance of every pixel to the nearest background pixel
+    return ndi.distance_transform_edt(img) > radius
+
+
+def closing(img, radius, method=None):
+    """
+    Binary closing by disk(radius). method is 'footprint' or
+    'edt'; by default it is chosen by the radius.
+    """
+    if _method(radius, method) == 'footprint':
+        return binary_closing(img, disk_footprint(radius))
+    return erosion(dilation(img, radius), radius)
+
+
+def opening(img, radius, method=None):
+    """
+    Binary opening by disk(radius), see closing.
+    """
+    if _method(radius, method) == 'footprint':
+        return binary_opening(img, disk_footprint(radius))
+    return dilation(erosion(img, radius), radius)
+
+
+def _method(radius, method):
+    if method is None:
+        return 'edt' if radius >= EDT_MIN_RADIUS else 'footprint'
+    if method not in ('footprint', 'edt'):
+        raise ValueError("There is no method '{}'!".format(method))
+    return method
+
+
+class ComponentFilter:
+    """
+    Removes small objects of a binary image and then small holes
+    of the result, as two calls of remove_small_objects do, but the
+    image is labeled once. Objects are True components, holes are
+    False components (4-connectivity). Sizes of the components and
+    their neighbours are kept, so other minimal sizes are applied
+    without labeling the image again.
+    """
+
+    def __init__(self, img):
+        objects, n_objects = ndi.label(img)
+        holes, n_holes = ndi.label(np.logical_not(img))
+        self.n_holes = n_holes
+        # Holes are 1..n_holes, objects follow them
+        self.labels = np.where(objects > 0, objects + n_holes, holes)
+        self.sizes = np.bincount(self.labels.ravel(),
+                                 minlength=n_holes + n_objects + 1)
+        self.pairs = self._neighbours(self.labels, n_holes,
+                                      len(self.sizes))
+
+    @staticmethod
+    def _neighbours(labels, n_holes, n_labels):
+        """
+        Returns unique (hole, object) pairs of touching components.
+        """
+        is_object = labels > n_holes
+        pairs = list()
+        for a, b, edge in ((labels[:, :-1], labels[:, 1:],
+                            is_object[:, :-1] != is_object[:, 1:]),
+                           (labels[:-1, :], labels[1:, :],
+                            is_object[:-1, :] != is_object[1:, :])):
+            a, b = a[edge].astype(np.int64), b[edge].astype(np.int64)
+            # Pairs are coded as single numbers to find unique ones fast
+            pairs.append(np.minimum(a, b) * n_labels +
+                         np.maximum(a, b))
+        pairs = np.unique(np.concatenate(pairs))
+        return np.stack(np.divmod(pairs, n_labels), axis=1)
+
+    def __call__(self, object_size, hole_size):
+        """
+        Returns holes of at least hole_size pixels after objects
+        smaller than object_size are removed.
+        """
+        return self._kept(object_size, hole_size)[self.labels]
+
+    def area(self, object_size, hole_size):
+        """
+        Returns number of pixels of the holes returned by __call__
+        without making the image.
+        """
+        kept = self._kept(object_size, hole_size)
+        return int(self.sizes[kept].sum())
+
+    def _kept(self, object_size, hole_size):
+        n_labels = len(self.sizes)
+        removed = np.zeros(n_labels, dtype=bool)
+        objects = slice(self.n_holes + 1, None)
+        removed[objects] = self.sizes[objects] < object_size
+        # Removed objects join the holes they touch
+        pairs = self.pairs[removed[self.pairs[:, 1]]]
+        graph = coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])),
+                           shape=(n_labels, n_labels))
+        _, component = connected_components(graph, directed=False)
+        hole = removed.copy()
+        hole[1:self.n_holes + 1] = True
+        merged_sizes = np.bincount(component, weights=self.sizes * hole)
+        return hole & (merged_sizes[component] >= hole_size)
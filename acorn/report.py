@@ -0,0 +1,409 @@
+# Reports written while images are analysed.
+# Every row is appended to the csv file as soon as it is made, so a
+# crash loses at most the rows which were not synced to the disk yet.
+# An existing report can be reopened, and files already analysed
+# with the same parameters are then skipped.
+
+import os
+import csv
+import zipfile
+import numpy as np
+from .accessory_functions import format_row
+
+
+def comparable(value):
+    """
+    Returns the value of the report cell or of a parameter in the
+    form used to compare them: numbers as float, other values as
+    the strings written to the report.
+    """
+    text = str(value).replace(',', '.')
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+
+# Column dtypes of the value types
+_dtypes = dict()
+
+
+def _dtype(value):
+    value_type = type(value)
+    if value_type not in _dtypes:
+        if issubclass(value_type, (bool, np.bool_)):
+            dtype = np.dtype(object)
+        elif issubclass(value_type, (int, np.integer)):
+            dtype = np.dtype(np.int64)
+        elif issubclass(value_type, (float, np.floating)):
+            dtype = np.dtype(np.float64)
+        else:
+            # Columns of other values are object arrays
+            dtype = np.dtype(object)
+        _dtypes[value_type] = dtype
+    return _dtypes[value_type]
+
+
+def _key_value(value):
+    # Numbers are compared as float, so 6 and 6.0 are the same;
+    # booleans as in the report, so True is not 1
+    if isinstance(value, (bool, np.bool_)):
+        return str(value)
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return float(value)
+    return value
+
+
+def _same(a, b):
+    # Missing statistics (nan) of rows are the same
+    return a == b or (a != a and b != b)
+
+
+class Report:
+    """
+    Rows of the report stored by columns. Values of stat_columns are
+    kept in numpy arrays; the other columns (parameters) are kept once
+    for every distinct set of their values and rows keep only its id.
+    Rows are added and returned as dicts {'file': ..., parameters,
+    statistics}; all rows must have the same columns.
+    Rows are indexed by their file and parameter set, so a duplicate
+    is found in constant time: a row is a duplicate if the last row
+    of the same file and parameters has the same statistics.
+    """
+
+    def __init__(self, stat_columns=(), rows=()):
+        self.stat_columns = list(stat_columns)
+        self.clear()
+        for row in rows:
+            self.append(row)
+
+    def clear(self):
+        self.columns = None
+        self.param_columns = list()
+        self.stat_names = list()
+        self.size = 0
+        self.file_names = list()
+        self.param_index = np.zeros(16, dtype=np.int32)
+        self.param_sets = list()
+        self.param_ids = dict()
+        self.stats = dict()
+        self.keys = dict()
+        self.files = dict()
+
+    def _start(self, row):
+        self.param_columns = [key for key in row if key != 'file' and
+                              key not in self.stat_columns]
+        self.stat_names = [key for key in row if key in self.stat_columns]
+        self.columns = ['file'] + self.param_columns + self.stat_names
+        capacity = len(self.param_index)
+        for key in self.stat_names:
+            self.stats[key] = np.zeros(capacity, dtype=_dtype(row[key]))
+
+    def _check(self, row):
+        if len(row) != len(self.columns) or \
+                any(key not in row for key in self.columns):
+            raise ValueError('Rows of the report have other columns!')
+
+    def _param_key(self, row):
+        values = tuple(_key_value(row[column])
+                       for column in self.param_columns)
+        try:
+            hash(values)
+        except TypeError:
+            values = tuple(comparable(value) for value in values)
+        return values
+
+    def _param_id(self, row):
+        key = self._param_key(row)
+        param_id = self.param_ids.get(key)
+        if param_id is None:
+            param_id = len(self.param_sets)
+            self.param_ids[key] = param_id
+            self.param_sets.append(tuple(row[column]
+                                         for column in self.param_columns))
+        return param_id
+
+    def _grow(self):
+        capacity = 2 * len(self.param_index)
+        self.param_index = np.resize(self.param_index, capacity)
+        for key, values in self.stats.items():
+            self.stats[key] = np.resize(values, capacity)
+
+    def _set(self, index, row, param_id):
+        self.param_index[index] = param_id
+        for key in self.stat_names:
+            value = row[key]
+            values = self.stats[key]
+            if values.dtype != object and _dtype(value) != values.dtype:
+                # Values of other types are kept as they are
+                values = self.stats[key] = values.astype(object)
+            values[index] = value
+
+    def _value(self, key, index):
+        value = self.stats[key][index]
+        return value if self.stats[key].dtype == object else value.item()
+
+    def _stat_values(self, index):
+        return [self._value(key, index) for key in self.stat_names]
+
+    def _duplicate(self, key, row):
+        index = self.keys.get(key)
+        if index is None:
+            return False
+        return all(_same(value, row[column]) for column, value in
+                   zip(self.stat_names, self._stat_values(index)))
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError('Report index out of range')
+        return dict(zip(self.columns,
+                        (self.file_names[index],
+                         *self.param_sets[self.param_index[index]],
+                         *self._stat_values(index))))
+
+    def __iter__(self):
+        n = self.size
+        param_index = self.param_index[:n].tolist()
+        stats = [self.stats[key][:n].tolist() for key in self.stat_names]
+        for index, (img_path, param_id) in enumerate(
+                zip(self.file_names, param_index)):
+            yield dict(zip(self.columns,
+                           (img_path, *self.param_sets[param_id],
+                            *(values[index] for values in stats))))
+
+    def __contains__(self, row):
+        if self.columns is None:
+            return False
+        self._check(row)
+        param_id = self.param_ids.get(self._param_key(row))
+        if param_id is None:
+            return False
+        return self._duplicate((row['file'], param_id), row)
+
+    def append(self, row):
+        """
+        Adds the row if the report does not have it yet.
+        Returns True if the row was added.
+        """
+        if self.columns is None:
+            self._start(row)
+        self._check(row)
+        param_id = self._param_id(row)
+        key = (row['file'], param_id)
+        if self._duplicate(key, row):
+            return False
+        if self.size == len(self.param_index):
+            self._grow()
+        index = self.size
+        self._set(index, row, param_id)
+        self.file_names.append(row['file'])
+        self.size += 1
+        self.keys[key] = index
+        self.files[row['file']] = index
+        return True
+
+    def replace(self, row):
+        """
+        Puts the row in place of the last row of its file
+        or adds it. Returns True if the report was changed.
+        """
+        index = self.files.get(row['file'])
+        if index is None:
+            return self.append(row)
+        self._check(row)
+        if row in self:
+            return False
+        param_id = self._param_id(row)
+        old_key = (row['file'], int(self.param_index[index]))
+        if self.keys.get(old_key) == index:
+            del self.keys[old_key]
+        self._set(index, row, param_id)
+        self.keys[(row['file'], param_id)] = index
+        return True
+
+    def find(self, img_path):
+        """
+        Returns the last row of the file or None.
+        """
+        index = self.files.get(img_path)
+        return None if index is None else self[index]
+
+    def as_columns(self):
+        """
+        Returns dict of numpy arrays: columns of all rows.
+        """
+        n = self.size
+        if n == 0:
+            return dict()
+        param_index = self.param_index[:n]
+        columns = {'file': np.array(self.file_names)}
+        for i, key in enumerate(self.param_columns):
+            values = np.array([values[i] for values in self.param_sets])
+            columns[key] = values[param_index]
+        for key in self.stat_names:
+            columns[key] = self.stats[key][:n].copy()
+        return columns
+
+    def save_csv(self, filename, fieldnames=None):
+        """
+        Saves rows as save_csv does. Parameters are formatted
+        once for every distinct set of them.
+        """
+        n = self.size
+        param_index = self.param_index[:n].tolist()
+        param_sets = [format_row(dict(zip(self.param_columns, values)))
+                      for values in self.param_sets]
+        columns = {'file': [name.replace('/', '\\')
+                            for name in self.file_names]}
+        for key in self.param_columns:
+            formatted = [values[key] for values in param_sets]
+            columns[key] = [formatted[i] for i in param_index]
+        for key in self.stat_names:
+            columns[key] = [str(value).replace('.', ',')
+                            for value in self.stats[key][:n].tolist()]
+        fieldnames = list(fieldnames or self.columns or [])
+        with open(filename, 'w', newline='') as csvfile:
+            writer = csv.writer(csvfile, delimiter=';')
+            writer.writerow(fieldnames)
+            writer.writerows(zip(*(columns[key] for key in fieldnames)))
+
+
+class ReportWriter:
+    """
+    Appends report rows to a csv file (';' separated, decimal commas).
+    Rows are passed to the system at once and synced to the disk
+    every fsync_every rows and by flush() and close().
+    If resume is True, rows of the existing file are kept and new
+    rows are appended; the file must have the same columns.
+    If npz is True, columns of all rows are also saved by close()
+    to a numpy .npz file next to the csv file.
+    """
+
+    def __init__(self, filename, fieldnames=None, resume=False,
+                 fsync_every=20, npz=False):
+        self.filename = filename
+        self.fieldnames = list(fieldnames) if fieldnames else None
+        self.fsync_every = fsync_every
+        self.npz = npz
+        self.rows = list()
+        self.done = dict()
+        self.unsynced = 0
+        self.file = None
+        self.writer = None
+        if resume and os.path.exists(filename):
+            self._reopen()
+        else:
+            self.file = open(filename, 'w', newline='')
+            if self.fieldnames:
+                self._start_writer()
+
+    def _reopen(self):
+        with open(self.filename, 'rb+') as f:
+            data = f.read()
+            # The last row may be cut by a crash
+            end = data.rfind(b'\n') + 1
+            if end < len(data):
+                f.truncate(end)
+        with open(self.filename, newline='') as f:
+            reader = csv.DictReader(f, delimiter=';')
+            fieldnames = reader.fieldnames
+            for row in reader:
+                self._index(row)
+        if fieldnames:
+            if self.fieldnames and self.fieldnames != fieldnames:
+                raise ValueError('Report {} has other columns!'.format(
+                    self.filename))
+            self.fieldnames = fieldnames
+        self.file = open(self.filename, 'a', newline='')
+        if self.fieldnames:
+            self.writer = csv.DictWriter(self.file, delimiter=';',
+                                         fieldnames=self.fieldnames)
+            if not fieldnames:
+                self.writer.writeheader()
+
+    def _start_writer(self):
+        self.writer = csv.DictWriter(self.file, delimiter=';',
+                                     fieldnames=self.fieldnames)
+        self.writer.writeheader()
+
+    def _index(self, formatted):
+        self.done.setdefault(formatted['file'], list()).append(
+            {key: comparable(value) for key, value in formatted.items()})
+        if self.npz:
+            self.rows.append(formatted)
+
+    def append(self, row):
+        if self.writer is None:
+            self.fieldnames = list(row.keys())
+            self._start_writer()
+        elif len(row) != len(self.fieldnames) or \
+                any(key not in row for key in self.fieldnames):
+            raise ValueError('Report {} has other columns!'.format(
+                self.filename))
+        formatted = format_row(row)
+        self.writer.writerow(formatted)
+        self.file.flush()
+        self._index(formatted)
+        self.unsynced += 1
+        if self.unsynced >= self.fsync_every:
+            self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+    def contains(self, img_path, params):
+        """
+        Checks whether the report has a row of the image made with
+        params. Parameters which are not in the report are ignored.
+        """
+        formatted = format_row({'file': img_path})['file']
+        for row in self.done.get(formatted, ()):
+            if all(row[key] == comparable(value)
+                   for key, value in params.items() if key in row):
+                return True
+        return False
+
+    def flush(self):
+        if self.unsynced > 0:
+            self.sync()
+
+    def close(self):
+        if self.file is None:
+            return
+        self.flush()
+        self.file.close()
+        self.file = None
+        if self.npz and self.rows:
+            save_npz(self.rows, os.path.splitext(self.filename)[0] + '.npz')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def save_npz(rows, filename):
+    """
+    Saves report rows as numpy columns: numbers as float arrays,
+    other values as string arrays.
+    """
+    columns = dict()
+    for key in rows[0]:
+        values = [comparable(row.get(key, '')) for row in rows]
+        if all(isinstance(value, float) for value in values):
+            columns[key] = np.array(values)
+        else:
+            columns[key] = np.array([str(row.get(key, '')) for row in rows])
+    # np.savez can't take 'file' as a name of an array
+    with zipfile.ZipFile(filename, 'w') as archive:
+        for key, column in columns.items():
+            with archive.open(key + '.npy', 'w') as f:
+                np.lib.format.write_array(f, column, allow_pickle=False)
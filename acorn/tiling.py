@@ -0,0 +1,734 @@
+# Tiled analysis of very large (e.g. stitched) images.
+# Images are processed in tiles with overlapping halos, so memory
+# used by the analysis depends on the tile size, not on the image.
+# Thresholds are found from histograms accumulated over all tiles;
+# objects cut by tile seams are joined into objects of the whole image.
+
+import tempfile
+import warnings
+import numpy as np
+from math import ceil
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageEnhance
+from PIL.ImageOps import invert
+from PIL.ImageFilter import GaussianBlur
+from scipy import ndimage as ndi
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from skimage.filters import sobel
+from skimage.morphology import watershed
+from .accessory_functions import HistogramThreshold
+from .image_analysis import WoundImage, CellConfluent, CellCounter
+from .image_analysis import cell_peaks, peaks_threshold
+from .morphology import closing, opening, disk_footprint
+
+
+class TileSource:
+    """
+    Reads windows of an image. source is a numpy array (e.g. memory
+    mapped), a .npy file, which is memory mapped, or an image file.
+    Image files are decoded by PIL as a whole, so only arrays and
+    .npy files keep memory bounded.
+    """
+
+    def __init__(self, source):
+        self.path = None
+        if isinstance(source, str):
+            self.path = source
+            if source.lower().endswith('.npy'):
+                source = np.load(source, mmap_mode='r')
+            else:
+                source = np.asarray(Image.open(source))
+        self.array = source
+        self.height, self.width = self.array.shape[:2]
+
+    def channel(self, channel, window):
+        """
+        Returns the channel of the window as PIL image and
+        the channel used, as CorrectedImage does: 'BW' for
+        one band images, 'Red' instead of 'BW' for RGB images.
+        """
+        y0, y1, x0, x1 = window
+        img = np.ascontiguousarray(self.array[y0:y1, x0:x1])
+        if img.ndim == 2:
+            return Image.fromarray(img), 'BW'
+        if channel == 'BW':
+            channel = 'Red'
+        band = ('Red', 'Green', 'Blue').index(channel)
+        return Image.fromarray(np.ascontiguousarray(img[..., band])), channel
+
+
+class StitchedLabels:
+    """
+    Joins objects labeled separately in every tile into objects
+    of the whole image. Objects touching across a seam
+    (4-connectivity) are joined.
+    """
+
+    def __init__(self, n_tiles):
+        self.tiles = [None] * n_tiles
+        self.offsets = None
+        self.component = None
+        self.sizes = None
+
+    def add(self, index, labels, n_labels):
+        """
+        Keeps sizes and border labels of the labeled core of a tile.
+        """
+        sizes = np.bincount(labels.ravel(), minlength=n_labels + 1)[1:]
+        borders = (labels[0].copy(), labels[-1].copy(),
+                   labels[:, 0].copy(), labels[:, -1].copy())
+        self.tiles[index] = (n_labels, sizes, borders)
+
+    def join(self, neighbours):
+        """
+        neighbours are (index, right index, bottom index) of tiles,
+        None if there is no neighbour. Computes objects and their sizes.
+        """
+        counts = [tile[0] for tile in self.tiles]
+        self.offsets = np.concatenate(([0], np.cumsum(counts)))
+        n_total = int(self.offsets[-1])
+        sizes = np.concatenate([[0]] + [tile[1] for tile in self.tiles])
+        pairs = [np.empty((0, 2), dtype=np.int64)]
+        for index, right, bottom in neighbours:
+            _, bottom_row, _, right_col = self.tiles[index][2]
+            if right is not None:
+                pairs.append(self._pairs(index, right_col,
+                                         right, self.tiles[right][2][2]))
+            if bottom is not None:
+                pairs.append(self._pairs(index, bottom_row,
+                                         bottom, self.tiles[bottom][2][0]))
+        pairs = np.concatenate(pairs)
+        graph = coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])),
+                           shape=(n_total + 1, n_total + 1))
+        _, component = connected_components(graph, directed=False)
+        # Background keeps component 0
+        order = np.unique(component[1:], return_inverse=True)[1]
+        self.component = np.concatenate(([0], order + 1))
+        self.sizes = np.bincount(self.component, weights=sizes)
+        self.sizes[0] = 0
+
+    def _pairs(self, index1, border1, index2, border2):
+        joined = (border1 > 0) & (border2 > 0)
+        ids1 = border1[joined] + self.offsets[index1]
+        ids2 = border2[joined] + self.offsets[index2]
+        return np.stack((ids1, ids2), axis=1)
+
+    def object_sizes(self, index, labels):
+        """
+        Returns sizes of the whole image objects for every pixel
+        of the tile labels; background pixels get 0.
+        """
+        ids = np.where(labels > 0, labels + self.offsets[index], 0)
+        return self.sizes[self.component[ids]]
+
+
+class TiledImage:
+    """
+    Splits the image into tiles of tile_size pixels and corrects them
+    as CorrectedImage does. Brightness and contrast use statistics of
+    the whole image; blur uses a halo around tiles, so results agree
+    with CorrectedImage up to rounding at the tile seams.
+    Tiles are processed by max_workers threads.
+    """
+
+    # Relative difference of statistics allowed by check
+    tolerance = 0
+
+    def __init__(self, source, tile_size=2048, max_workers=None):
+        self.source = TileSource(source)
+        self.height = self.source.height
+        self.width = self.source.width
+        # Binary tiles are packed into bytes
+        self.tile_size = max(8, int(ceil(tile_size / 8)) * 8)
+        self.max_workers = max_workers
+        self.rows = list(range(0, self.height, self.tile_size))
+        self.cols = list(range(0, self.width, self.tile_size))
+        self.tiles = [(y0, min(y0 + self.tile_size, self.height),
+                       x0, min(x0 + self.tile_size, self.width))
+                      for y0 in self.rows for x0 in self.cols]
+        self.channel = None
+
+    def __call__(self, channel='BW', bright=1.0, contr=1.0,
+                 blur_radius=0, equal_exposure=False,
+                 inverse=False, **kwargs):
+        if equal_exposure:
+            raise ValueError('Equal exposure is not available '
+                             'for tiled images!')
+        self.channel = channel
+        self.bright = bright
+        self.contr = contr
+        self.blur_radius = blur_radius
+        self.equal_exposure = equal_exposure
+        self.inverse = inverse
+        self.blur_halo = int(ceil(3 * blur_radius)) + 1 if blur_radius else 0
+        self.contrast_mean = 0
+        if contr != 1.0:
+            total = sum(self._map(self._brightened_sum))
+            self.contrast_mean = int(total / (self.height * self.width) + 0.5)
+
+    def _map(self, fun, items=None):
+        """
+        Returns fun(item) for all items in their order,
+        by default for indices of all tiles.
+        """
+        if items is None:
+            items = range(len(self.tiles))
+        if self.max_workers == 1:
+            return [fun(item) for item in items]
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            return list(executor.map(fun, items))
+
+    def _window(self, index, halo):
+        """
+        Returns the tile with halo and slices of the tile in it.
+        """
+        y0, y1, x0, x1 = self.tiles[index]
+        wy0, wx0 = max(y0 - halo, 0), max(x0 - halo, 0)
+        wy1 = min(y1 + halo, self.height)
+        wx1 = min(x1 + halo, self.width)
+        core = (slice(y0 - wy0, y1 - wy0), slice(x0 - wx0, x1 - wx0))
+        return (wy0, wy1, wx0, wx1), core
+
+    def _neighbours(self):
+        n_cols = len(self.cols)
+        n_rows = len(self.rows)
+        for index in range(len(self.tiles)):
+            row, col = divmod(index, n_cols)
+            right = index + 1 if col + 1 < n_cols else None
+            bottom = index + n_cols if row + 1 < n_rows else None
+            yield index, right, bottom
+
+    def _window_tiles(self, window):
+        """
+        Returns indices of the tiles in the window.
+        """
+        wy0, wy1, wx0, wx1 = window
+        n_cols = len(self.cols)
+        return [r * n_cols + c
+                for r in range(wy0 // self.tile_size,
+                               (wy1 - 1) // self.tile_size + 1)
+                for c in range(wx0 // self.tile_size,
+                               (wx1 - 1) // self.tile_size + 1)]
+
+    def _brightened_sum(self, index):
+        window, _ = self._window(index, 0)
+        img, self.channel = self.source.channel(self.channel, window)
+        if self.inverse:
+            img = invert(img)
+        img = ImageEnhance.Brightness(img).enhance(self.bright)
+        return np.asarray(img).sum(dtype=np.int64)
+
+    def _corrected(self, window):
+        img, self.channel = self.source.channel(self.channel, window)
+        if self.inverse:
+            img = invert(img)
+        if self.bright == 1.0 and self.contr == 1.0 and self.blur_radius == 0:
+            return np.asarray(img)
+        img = ImageEnhance.Brightness(img).enhance(self.bright)
+        contrast = ImageEnhance.Contrast(img)
+        contrast.degenerate = Image.new('L', img.size, self.contrast_mean)
+        img = contrast.enhance(self.contr)
+        img = img.filter(GaussianBlur(self.blur_radius))
+        return np.asarray(img)
+
+    def called_with(self):
+        d = {'channel': self.channel,
+             'bright': self.bright,
+             'contr': self.contr,
+             'blur_radius': self.blur_radius,
+             'equal_exposure': self.equal_exposure,
+             'inverse': self.inverse}
+        return d
+
+    def get_image_path(self):
+        return self.source.path
+
+    def check(self, tolerance=None):
+        """
+        Analyses the image as a whole with the parameters of the last
+        call and raises ValueError if the report statistics differ
+        by more than tolerance (relative; by default the tolerance
+        of the class). The image must fit in memory.
+        """
+        if tolerance is None:
+            tolerance = self.tolerance
+        analyzer = self.analyzer(self.get_image_path())
+        analyzer(**self._analyzer_params())
+        stat = analyzer.get_report_stat()
+        tiled = self.get_report_stat()
+        for key, value in stat.items():
+            if abs(tiled[key] - value) > tolerance * abs(value):
+                raise ValueError('Tiled statistics {} differ from {}!'
+                                 .format(tiled, stat))
+
+    def _analyzer_params(self):
+        return self.called_with()
+
+
+class TiledBinaryImage(TiledImage):
+    """
+    Thresholds tiles with a threshold found from the histogram
+    of the whole pre-binary image.
+    """
+
+    def __call__(self, filt, mode='Borders', offset=0, **kwargs):
+        super().__call__(**kwargs)
+        self.filt = filt
+        self.mode = mode
+        self.offset = offset
+        self.pre_halo = self.blur_halo + (1 if mode == 'Borders' else 0)
+        self.histogram = self._histogram(mode)
+        self.thresh = self.histogram(filt, offset)
+
+    def _pre_binary(self, window, mode):
+        img = self._corrected(window)
+        if mode == 'Borders':
+            return sobel(img)
+        elif mode == 'Contrast' or mode == 'Contrast-positive':
+            return img
+        else:
+            raise ValueError("There is no mode '{}'!".format(mode))
+
+    def _core_pre_binary(self, index, mode):
+        window, core = self._window(index, self.pre_halo)
+        return self._pre_binary(window, mode)[core]
+
+    def _histogram(self, mode):
+        if mode != 'Borders':
+            counts = sum(self._map(lambda index: np.bincount(
+                self._core_pre_binary(index, mode).ravel(), minlength=256)))
+            mean = np.dot(counts, np.arange(len(counts))) / counts.sum()
+            return HistogramThreshold.from_histogram(
+                counts, np.arange(len(counts)), mean, np.uint8)
+        stats = np.array(self._map(lambda index: self._range_sum(index,
+                                                                 mode)))
+        low, high = stats[:, 0].min(), stats[:, 1].max()
+        mean = stats[:, 2].sum() / (self.height * self.width)
+        if low == high:
+            return HistogramThreshold.from_histogram([1], [low], mean, float)
+        edges = np.histogram_bin_edges([], bins=256, range=(low, high))
+        counts = sum(self._map(lambda index: np.histogram(
+            self._core_pre_binary(index, mode), bins=edges)[0]))
+        centers = (edges[:-1] + edges[1:]) / 2
+        return HistogramThreshold.from_histogram(counts, centers,
+                                                 mean, float)
+
+    def _range_sum(self, index, mode):
+        img = self._core_pre_binary(index, mode)
+        return img.min(), img.max(), img.sum()
+
+    def _binary(self, pre_binary, thresh, mode):
+        if mode == 'Contrast':
+            return pre_binary < thresh
+        return pre_binary > thresh
+
+    def called_with(self):
+        d = {'filt': self.filt,
+             'mode': self.mode,
+             'offset': self.offset}
+        return {**super().called_with(), **d}
+
+
+class TiledWoundImage(TiledBinaryImage):
+    """
+    Estimates area and mean width of the wound as WoundImage does,
+    tile by tile. Binary tiles are kept packed in a temporary file;
+    objects removed by min_objects and min_wound are measured
+    across tile seams. If out (an array of the image shape, e.g.
+    memory mapped) is given, the wound mask is written into it.
+    """
+
+    analyzer = WoundImage
+
+    def __call__(self, disk_radius, min_objects, min_wound,
+                 out=None, **kwargs):
+        super().__call__(**kwargs)
+        self.disk_radius = int(disk_radius)
+        self.min_objects = min_objects
+        self.min_wound = min_wound
+        # Closing and opening move borders by 4 radii at most
+        halo = self.pre_halo + 4 * self.disk_radius + 1
+        pixels = self.height * self.width
+        white_size = round(pixels * self.min_objects / 100)
+        black_size = round(pixels * self.min_wound / 100)
+        with tempfile.TemporaryFile() as f:
+            self.bits = np.memmap(f, dtype=np.uint8, mode='w+',
+                                  shape=(self.height,
+                                         int(ceil(self.width / 8))))
+            objects = StitchedLabels(len(self.tiles))
+            self._map(lambda index: self._label_binary(index, halo,
+                                                       objects))
+            objects.join(self._neighbours())
+            holes = StitchedLabels(len(self.tiles))
+            self._map(lambda index: self._label_holes(index, objects,
+                                                      white_size, holes))
+            holes.join(self._neighbours())
+            sizes = holes.sizes[1:]
+            self.wound_pixels = sizes[sizes >= black_size].sum()
+            if out is not None:
+                self._map(lambda index: self._write_wound(
+                    index, objects, white_size, holes, black_size, out))
+            del self.bits
+        self.pixels = pixels
+
+    def _label_binary(self, index, halo, objects):
+        window, core = self._window(index, halo)
+        pre_binary = self._pre_binary(window, self.mode)
+        img = self._binary(pre_binary, self.thresh, self.mode)
+        img = closing(img, self.disk_radius)
+        img = opening(img, self.disk_radius)[core]
+        y0, y1, x0, x1 = self.tiles[index]
+        packed = np.packbits(img, axis=1)
+        self.bits[y0:y1, x0 // 8:x0 // 8 + packed.shape[1]] = packed
+        objects.add(index, *ndi.label(img))
+
+    def _read_binary(self, index):
+        y0, y1, x0, x1 = self.tiles[index]
+        width = x1 - x0
+        packed = self.bits[y0:y1, x0 // 8:x0 // 8 + int(ceil(width / 8))]
+        return np.unpackbits(packed, axis=1, count=width).astype(bool)
+
+    def _without_grains(self, index, objects, white_size):
+        img = self._read_binary(index)
+        labels, _ = ndi.label(img)
+        # Objects inside the wound are removed
+        return img & (objects.object_sizes(index, labels) >= white_size)
+
+    def _label_holes(self, index, objects, white_size, holes):
+        img = self._without_grains(index, objects, white_size)
+        holes.add(index, *ndi.label(np.logical_not(img)))
+
+    def _write_wound(self, index, objects, white_size, holes,
+                     black_size, out):
+        img = np.logical_not(self._without_grains(index, objects,
+                                                  white_size))
+        labels, _ = ndi.label(img)
+        y0, y1, x0, x1 = self.tiles[index]
+        out[y0:y1, x0:x1] = holes.object_sizes(index, labels) >= black_size
+
+    def get_stat(self):
+        area = self.wound_pixels * 100 / self.pixels
+        width = self.wound_pixels / self.height
+        return (area, width)
+
+    def get_report_stat(self):
+        area, width = self.get_stat()
+        return {'wound_area': round(area, 2),
+                'wound_width': round(width, 2)}
+
+    def called_with(self):
+        d = {'disk_radius': self.disk_radius,
+             'min_objects': self.min_objects,
+             'min_wound': self.min_wound}
+        return {**super().called_with(), **d}
+
+
+class TiledCellConfluent(TiledWoundImage):
+
+    analyzer = CellConfluent
+
+    def get_stat(self):
+        return 100 - self.wound_pixels * 100 / self.pixels
+
+    def get_report_stat(self):
+        return {'confluent': round(self.get_stat(), 1)}
+
+
+class TiledCellCounter(TiledBinaryImage):
+    """
+    Counts cells as CellCounter does, tile by tile. Every tile is
+    flooded with the markers of the tile with halo pixels around it
+    (by default half of the tile size), so memory used depends on
+    the tile size only. Markers are found in every tile with the
+    threshold of the whole image and numbered in the raster order
+    of the image, so cells cut by seams get the labels and sizes of
+    the whole image. Parts of cells whose markers are beyond the halo
+    are not flooded in their tile; they are joined after the flood to
+    the cells they touch across seams.
+    Labels may still differ from CellCounter where watershed paths
+    leave the halo, where equally deep basins are flooded in another
+    order, or where cells are wider than the halo, which makes
+    distances inexact (a warning is issued), so statistics agree within
+    tolerance. If out is given, labels are written into it.
+    """
+
+    analyzer = CellCounter
+    # Relative difference of statistics allowed by check
+    tolerance = 0.01
+
+    def __call__(self, channel,
+                 binary_filter=None, mask_filter=None,
+                 offset_binary=None, offset_mask=None,
+                 min_dist=None, disk_radius=None,
+                 size_thresh=None, halo=None, out=None,
+                 **kwargs):
+        d = CellCounter.defaults
+        self.binary_filter = binary_filter or d['binary_filter']
+        self.mask_filter = mask_filter or d['mask_filter']
+        self.offset_binary = offset_binary or d['offset_binary']
+        self.offset_mask = offset_mask or d['offset_mask']
+        self.min_dist = min_dist or d['min_dist']
+        self.disk_radius = disk_radius or d['disk_radius']
+        self.size_thresh = size_thresh or d['size_thresh']
+        super().__call__(channel=channel, filt=self.binary_filter,
+                         mode='Contrast-positive',
+                         offset=self.offset_binary, **kwargs)
+        self.thresh_mask = self.histogram(self.mask_filter,
+                                          self.offset_mask)
+        radius = max(1, int(round(self.disk_radius)))
+        self.footprint = disk_footprint(radius)
+        # Peaks depend on distances in their footprint and
+        # on peaks closer than min_dist
+        self.reach = radius + 2 * int(self.min_dist) + 1
+        self.halo = max(int(halo or self.tile_size // 2), 2 * self.reach)
+        self.depth = min(4 * int(self.min_dist + self.disk_radius) + 1,
+                         self.halo - self.reach)
+        self.halos = [None] * len(self.tiles)
+        ranges = np.array(self._map(self._exact_window))
+        n_inexact = np.count_nonzero(ranges[:, 2] == 0)
+        if n_inexact:
+            warnings.warn('Distances in {} tiles are not exact: cells are '
+                          'wider than the halo {}!'.format(n_inexact,
+                                                           self.halo))
+        threshold = peaks_threshold(ranges[:, 0].min(), ranges[:, 1].max())
+        peaks = [None] * len(self.tiles)
+        groups = self._groups(self.halos)
+        for (_, indices), group_peaks in zip(groups, self._map(
+                lambda group: self._find_peaks(group, threshold), groups)):
+            for index, tile_peaks in zip(indices, group_peaks):
+                peaks[index] = tile_peaks
+        self._number_markers(peaks)
+        label_sizes = np.zeros(self.n_markers + 1, dtype=np.int64)
+        seams = [None] * len(self.tiles)
+        flood_halo = self.halo + self.pre_halo
+        groups = self._groups([flood_halo] * len(self.tiles))
+        for (_, indices), group_labels in zip(groups, self._map(
+                lambda group: self._flood(group, flood_halo, out), groups)):
+            for index, (labels, counts, seam) in zip(indices, group_labels):
+                label_sizes[labels] += counts
+                seams[index] = seam
+        self._join_fragments(seams, label_sizes, out)
+        self.label_sizes = label_sizes
+        num = np.flatnonzero(label_sizes)
+        self.size = label_sizes[num]
+        self.N_objects = max(num)
+        self.N_cells = np.count_nonzero(self.size[1:] >= self.size_thresh)
+        self.N_debris = self.N_objects - self.N_cells
+
+    def _groups(self, halos):
+        """
+        Returns (window, indices) of tiles with the same window,
+        which are processed together.
+        """
+        groups = dict()
+        for index, halo in enumerate(halos):
+            window = self._window(index, halo)[0]
+            groups.setdefault(window, list()).append(index)
+        return list(groups.items())
+
+    def _exact_window(self, index):
+        """
+        Finds the halo of the tile, which makes distances exact
+        within reach pixels around the tile; windows are not widened
+        beyond the halo of the counter. Returns the minimum and the
+        maximum distance of the tile and 1 if distances are exact.
+        """
+        depth = self.depth
+        while True:
+            halo = self.reach + depth + self.pre_halo
+            self.halos[index] = halo
+            window, core = self._window(index, halo)
+            distance = self._distance(window)[0]
+            wy0, wy1, wx0, wx1 = window
+            y0, y1, x0, x1 = self.tiles[index]
+            region = distance[max(y0 - self.reach, 0) - wy0:
+                              min(y1 + self.reach, self.height) - wy0,
+                              max(x0 - self.reach, 0) - wx0:
+                              min(x1 + self.reach, self.width) - wx0]
+            # A distance up to depth reaches only pixels of the window
+            # corrected as in the whole image, so it is exact
+            exact = (region.max() <= depth or
+                     window == (0, self.height, 0, self.width))
+            if exact or self.reach + depth >= self.halo:
+                return distance[core].min(), distance[core].max(), exact
+            depth = min(max(2 * depth, int(ceil(region.max())) + 1),
+                        self.halo - self.reach)
+
+    def _distance(self, window):
+        corrected = self._corrected(window)
+        img_binary = corrected > self.thresh
+        img_mask = corrected > self.thresh_mask
+        return ndi.distance_transform_edt(img_binary), img_mask
+
+    def _find_peaks(self, group, threshold):
+        """
+        Returns peaks of the tiles of the group (window, indices).
+        """
+        window, indices = group
+        distance = self._distance(window)[0]
+        peaks = cell_peaks(distance, int(self.min_dist), self.footprint,
+                           threshold)
+        tile_peaks = list()
+        for index in indices:
+            core = self._window(index, self.halos[index])[1]
+            markers, n_markers = ndi.label(peaks[core])
+            rows, cols = np.nonzero(markers)
+            y0, _, x0, _ = self.tiles[index]
+            tile_peaks.append((rows + y0, cols + x0, markers[rows, cols]))
+        return tile_peaks
+
+    def _number_markers(self, peaks):
+        # Markers get ids of the whole image in the order of their
+        # first pixels, as ndi.label numbers them in CellCounter
+        firsts = list()
+        for rows, cols, ids in peaks:
+            first = np.full(ids.max() + 1 if len(ids) else 1,
+                            np.iinfo(np.int64).max)
+            np.minimum.at(first, ids,
+                          rows.astype(np.int64) * self.width + cols)
+            firsts.append(first[1:])
+        firsts = np.concatenate(firsts)
+        order = np.argsort(firsts, kind='stable')
+        numbers = np.empty(len(firsts), dtype=np.int64)
+        numbers[order] = np.arange(1, len(firsts) + 1)
+        self.markers = list()
+        offset = 0
+        for rows, cols, ids in peaks:
+            self.markers.append((rows, cols, numbers[offset + ids - 1]))
+            offset += ids.max() if len(ids) else 0
+        self.n_markers = len(firsts)
+
+    def _flood(self, group, halo, out):
+        """
+        Returns labels of the tiles of the group, their sizes and
+        the seams of the tiles: labels of the borders, where
+        fragments (parts of the mask without markers in the window)
+        are negative, sizes of fragments and their pixels.
+        """
+        window, indices = group
+        distance, img_mask = self._distance(window)
+        wy0, wy1, wx0, wx1 = window
+        markers = np.zeros(distance.shape, dtype=np.int64)
+        for tile in self._window_tiles(window):
+            rows, cols, ids = self.markers[tile]
+            inside = ((rows >= wy0) & (rows < wy1) &
+                      (cols >= wx0) & (cols < wx1))
+            markers[rows[inside] - wy0, cols[inside] - wx0] = ids[inside]
+        labels = watershed(-distance, markers, mask=img_mask,
+                           watershed_line=True)
+        components, _ = ndi.label(img_mask)
+        flooded = np.unique(components[markers > 0])
+        fragments = img_mask & ~np.isin(components, flooded)
+        tiles = list()
+        for index in indices:
+            core = self._window(index, halo)[1]
+            tile_labels = labels[core]
+            if out is not None:
+                y0, y1, x0, x1 = self.tiles[index]
+                out[y0:y1, x0:x1] = tile_labels
+            tile_fragments, _ = ndi.label(fragments[core])
+            ids = tile_labels - tile_fragments
+            borders = (ids[0].copy(), ids[-1].copy(),
+                       ids[:, 0].copy(), ids[:, -1].copy())
+            rows, cols = np.nonzero(tile_fragments)
+            fragment_ids = tile_fragments[rows, cols]
+            seam = (borders, np.bincount(fragment_ids)[1:],
+                    (rows, cols, fragment_ids))
+            tiles.append(np.unique(tile_labels, return_counts=True) + (seam,))
+        return tiles
+
+    def _join_fragments(self, seams, label_sizes, out):
+        """
+        Joins fragments to the labels they touch across seams
+        (through other fragments too); a fragment touching several
+        labels is joined to the smallest. Sizes of fragments are moved
+        from the background to their labels; labels are written into
+        out if it is given.
+        """
+        counts = [len(seam[1]) for seam in seams]
+        if sum(counts) == 0:
+            return
+        offsets = self.n_markers + 1 + np.concatenate(([0],
+                                                       np.cumsum(counts)))
+        n_nodes = int(offsets[-1])
+
+        def nodes(index, border):
+            return np.where(border < 0, offsets[index] - border - 1, border)
+
+        pairs = [np.empty((0, 2), dtype=np.int64)]
+        for index, right, bottom in self._neighbours():
+            _, bottom_row, _, right_col = seams[index][0]
+            if right is not None:
+                pairs.append(self._fragment_pairs(
+                    nodes(index, right_col), nodes(right, seams[right][0][2])))
+            if bottom is not None:
+                pairs.append(self._fragment_pairs(
+                    nodes(index, bottom_row),
+                    nodes(bottom, seams[bottom][0][0])))
+        pairs = np.concatenate(pairs)
+        graph = coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])),
+                           shape=(n_nodes, n_nodes))
+        n_components, component = connected_components(graph,
+                                                       directed=False)
+        no_label = self.n_markers + 1
+        component_label = np.full(n_components, no_label)
+        np.minimum.at(component_label, component[1:no_label],
+                      np.arange(1, no_label))
+        component_label[component_label == no_label] = 0
+        joined = component_label[component[no_label:]]
+        sizes = np.concatenate([seam[1] for seam in seams])
+        np.add.at(label_sizes, joined, sizes)
+        label_sizes[0] -= sizes.sum()
+        if out is not None:
+            for index, seam in enumerate(seams):
+                rows, cols, ids = seam[2]
+                y0, _, x0, _ = self.tiles[index]
+                out[rows + y0, cols + x0] = joined[offsets[index] -
+                                                   no_label + ids - 1]
+
+    def _fragment_pairs(self, nodes1, nodes2):
+        # Fragments are the nodes after the labels
+        fragment = (nodes1 > self.n_markers) | (nodes2 > self.n_markers)
+        joined = fragment & (nodes1 > 0) & (nodes2 > 0)
+        return np.stack((nodes1[joined], nodes2[joined]), axis=1)
+
+    def get_stat(self):
+        return (self.N_objects, self.N_debris, self.N_cells)
+
+    def get_additional_stat(self):
+        cell_size = self.size[1:][self.size[1:] >= self.size_thresh]
+        mean_cell_size = np.mean(cell_size)
+        sd_cell_size = np.std(cell_size)
+        sizes = self.label_sizes[1:]
+        confl = np.sum(sizes[sizes >= self.size_thresh])
+        return (mean_cell_size, sd_cell_size,
+                confl * 100 / (self.height * self.width))
+
+    def get_report_stat(self):
+        stat = self.get_stat() + self.get_additional_stat()
+        headers = ['N_objects', 'N_debris', 'N_cells',
+                   'mean_cell_size', 'sd_cell_size', 'confl']
+        d = dict()
+        for head, st in zip(headers, stat):
+            d[head] = st if st == int(st) else round(st, 2)
+        return d
+
+    def _analyzer_params(self):
+        params = self.called_with()
+        # CellCounter sets the mode itself
+        del params['mode']
+        return params
+
+    def called_with(self):
+        binary_call = super().called_with()
+        del binary_call['filt']
+        del binary_call['offset']
+        d = {'binary_filter': self.binary_filter,
+             'mask_filter': self.mask_filter,
+             'offset_binary': self.offset_binary,
+             'offset_mask': self.offset_mask,
+             'min_dist': self.min_dist,
+             'disk_radius': self.disk_radius,
+             'size_thresh': self.size_thresh}
+        return {**binary_call, **d}
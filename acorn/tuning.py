@@ -0,0 +1,331 @@
+# Tuning of analysis parameters.
+# offset_sweep gives wound area or confluence for the whole range
+# of threshold offsets from one histogram of the image;
+# PipelineSweep runs the whole analysis for a coarse grid of
+# offsets in a pool of worker processes;
+# ParameterSearch looks for parameters which reproduce reference
+# masks or manual counts of annotated images.
+
+import os
+import json
+import itertools
+import numpy as np
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+from .image_analysis import BinaryImage
+from .batch import ANALYZERS, MODELS, make_parameters
+
+
+SWEEP_ASSAYS = ('wound', 'confluent')
+
+PIPELINE_OFFSETS = np.arange(-50, 51, 5)
+
+
+def _check_sweep_assay(assay):
+    if assay not in SWEEP_ASSAYS:
+        raise ValueError("There is no offset sweep for '{}'!".format(assay))
+
+
+def offset_sweep(assay, img_path, params=None, offsets=None):
+    """
+    Returns offsets and wound area or confluence (%) before
+    morphological operations for every offset.
+    """
+    _check_sweep_assay(assay)
+    image = ANALYZERS[assay](img_path)
+    # Only correction and thresholding are needed for the sweep
+    BinaryImage.__call__(image, **make_parameters(assay, params))
+    if offsets is None:
+        offsets = image.sweep_offsets
+    return offsets, image.offset_sweep(offsets)
+
+
+def analysed_area(image):
+    """
+    Returns wound area or confluence (%) of the analysed image.
+    """
+    stat = image.get_stat()
+    if isinstance(stat, tuple):
+        return stat[0]
+    return stat
+
+
+def _pipeline_sweep(assay, img_path, params, offsets):
+    # Runs inside the worker processes. The analyzer keeps
+    # the corrected image for all offsets of the worker.
+    image = ANALYZERS[assay](img_path)
+    values = list()
+    for offset in offsets:
+        image(**{**params, 'offset': float(offset)})
+        values.append(analysed_area(image))
+    return values
+
+
+class PipelineSweep:
+    """
+    Runs the whole analysis of one image for a coarse grid
+    of offsets in a pool of worker processes. Offsets are split
+    between the workers, so every worker corrects the image once.
+    """
+
+    def __init__(self, assay, img_path, params=None,
+                 offsets=None, max_workers=None):
+        _check_sweep_assay(assay)
+        self.assay = assay
+        self.img_path = img_path
+        self.params = make_parameters(assay, params)
+        if offsets is None:
+            offsets = PIPELINE_OFFSETS
+        self.offsets = np.asarray(offsets)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.executor = None
+        self.futures = []
+
+    def parts(self):
+        """
+        Returns indices of the offsets computed by every worker.
+        """
+        n = min(self.max_workers, len(self.offsets))
+        return [np.arange(i, len(self.offsets), n) for i in range(n)]
+
+    def _submit(self, executor, index):
+        return executor.submit(_pipeline_sweep, self.assay,
+                               self.img_path, self.params,
+                               self.offsets[index])
+
+    def start(self, callback):
+        """
+        Submits offsets to the pool and returns without waiting.
+        callback(offsets, values, error) is called from a pool
+        thread for every part of the offsets.
+        """
+        self.executor = ProcessPoolExecutor(self.max_workers)
+        self.futures = []
+        for index in self.parts():
+            future = self._submit(self.executor, index)
+            future.add_done_callback(partial(self._done,
+                                             self.offsets[index],
+                                             callback))
+            self.futures.append(future)
+
+    @staticmethod
+    def _done(offsets, callback, future):
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is None:
+            callback(offsets, future.result(), None)
+        else:
+            callback(offsets, None, error)
+
+    def stop(self, cancel=False):
+        """
+        Shuts down the pool started by start().
+        """
+        if self.executor is not None:
+            if cancel:
+                for future in self.futures:
+                    future.cancel()
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+    def __call__(self):
+        """
+        Returns offsets and wound area or confluence (%) for them.
+        """
+        values = np.empty(len(self.offsets))
+        with ProcessPoolExecutor(self.max_workers) as executor:
+            futures = [(index, self._submit(executor, index))
+                       for index in self.parts()]
+            for index, future in futures:
+                values[index] = future.result()
+        return self.offsets, values
+
+
+# Parameters in the order of the processing stages. Combinations
+# are sorted in this order, so the following combination changes
+# the latest stages and the cached earlier stages are reused.
+STAGE_ORDER = ['channel', 'bright', 'contr', 'blur_radius',
+               'equal_exposure', 'inverse',
+               'mode', 'filt', 'offset',
+               'binary_filter', 'offset_binary',
+               'mask_filter', 'offset_mask',
+               'min_dist', 'disk_radius',
+               'min_objects', 'min_wound',
+               'size_thresh']
+
+# Statistics compared with manual measurements
+REFERENCE_STATS = {'wound': 'wound_area',
+                   'counter': 'N_cells',
+                   'confluent': 'confluent'}
+
+
+def load_reference(reference):
+    """
+    Returns a reference mask or a manual measurement. File
+    names are read as masks: non-black pixels are True.
+    """
+    if isinstance(reference, str):
+        return np.asarray(Image.open(reference).convert('L')) > 0
+    if isinstance(reference, (int, float, np.number)):
+        return reference
+    return np.asarray(reference, dtype=bool)
+
+
+def predicted_mask(assay, image):
+    """
+    Returns the wound (wound assay) or cells (confluent assay)
+    found by the analysed image.
+    """
+    if assay == 'wound':
+        return image.img_binary
+    elif assay == 'confluent':
+        return np.logical_not(image.img_binary)
+    raise ValueError("There are no reference masks for '{}'!".format(assay))
+
+
+def reference_error(assay, image, reference):
+    """
+    Compares the analysed image with its reference:
+    1 - intersection over union for masks, relative error
+    of REFERENCE_STATS for manual measurements.
+    """
+    if isinstance(reference, np.ndarray):
+        mask = predicted_mask(assay, image)
+        if mask.shape != reference.shape:
+            raise ValueError('Reference mask of {} has shape {}, '
+                             'the image has {}'.format(
+                                 image.get_image_path(),
+                                 reference.shape, mask.shape))
+        union = np.count_nonzero(mask | reference)
+        if union == 0:
+            return 0.0
+        return 1 - np.count_nonzero(mask & reference) / union
+    stat = image.get_report_stat()[REFERENCE_STATS[assay]]
+    return abs(stat - reference) / max(abs(reference), 1)
+
+
+def _search_part(assay, img_path, reference, combinations):
+    # Runs inside the worker processes. Combinations are sorted,
+    # so the analyzer reuses stages shared by neighbours.
+    reference = load_reference(reference)
+    image = ANALYZERS[assay](img_path)
+    errors = list()
+    for params in combinations:
+        image(**params)
+        errors.append(reference_error(assay, image, reference))
+    return errors
+
+
+def _stage_index(name):
+    if name in STAGE_ORDER:
+        return STAGE_ORDER.index(name)
+    return len(STAGE_ORDER)
+
+
+class ParameterSearch:
+    """
+    Looks for parameters of the assay which reproduce references
+    of annotated images. references maps image paths to reference
+    masks (file names or arrays; wound for the wound assay, cells
+    for the confluent assay) or to manual measurements
+    (REFERENCE_STATS). grid maps parameters to lists of values;
+    all combinations are tried, or n_random of them.
+    Parameters which are not in the grid are taken from params.
+    """
+
+    def __init__(self, assay, references, grid, params=None,
+                 n_random=None, seed=None, max_workers=None):
+        if assay not in ANALYZERS:
+            raise ValueError("There is no assay '{}'!".format(assay))
+        self.assay = assay
+        self.references = references
+        self.names = sorted(grid, key=_stage_index)
+        self.values = [list(grid[name]) for name in self.names]
+        self.params = params or dict()
+        self.n_random = n_random
+        self.seed = seed
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.result = []
+
+    def combinations(self):
+        """
+        Returns searched combinations sorted in the stage order.
+        """
+        sizes = [len(v) for v in self.values]
+        n_total = int(np.prod(sizes))
+        if self.n_random is None or self.n_random >= n_total:
+            return [dict(zip(self.names, values))
+                    for values in itertools.product(*self.values)]
+        rng = np.random.default_rng(self.seed)
+        chosen = np.sort(rng.choice(n_total, self.n_random, replace=False))
+        combinations = list()
+        for position in zip(*np.unravel_index(chosen, sizes)):
+            combinations.append({name: values[i] for name, values, i
+                                 in zip(self.names, self.values, position)})
+        return combinations
+
+    def _parts(self, n_combinations):
+        # Contiguous parts keep neighbouring combinations together
+        n_images = len(self.references)
+        n = max(1, min(n_combinations, -(-self.max_workers // n_images)))
+        bounds = np.linspace(0, n_combinations, n + 1).astype(int)
+        return [(a, b) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+    def __call__(self, n_best=None):
+        """
+        Returns results sorted by mean error over the images:
+        dicts with 'params' (searched parameters), 'error' and
+        'errors' of every image.
+        """
+        combinations = self.combinations()
+        full = [make_parameters(self.assay, {**self.params, **c})
+                for c in combinations]
+        paths = list(self.references)
+        errors = np.empty((len(combinations), len(paths)))
+        with ProcessPoolExecutor(self.max_workers) as executor:
+            futures = list()
+            for column, path in enumerate(paths):
+                for a, b in self._parts(len(combinations)):
+                    future = executor.submit(_search_part, self.assay,
+                                             path, self.references[path],
+                                             full[a:b])
+                    futures.append((column, a, b, future))
+            for column, a, b, future in futures:
+                errors[a:b, column] = future.result()
+        mean = errors.mean(axis=1)
+        self.result = [{'params': combinations[i],
+                        'error': float(mean[i]),
+                        'errors': dict(zip(paths, errors[i].tolist()))}
+                       for i in np.argsort(mean, kind='stable')]
+        return self.result[:n_best]
+
+    def best(self):
+        """
+        Returns all parameters of the best combination.
+        """
+        if len(self.result) == 0:
+            raise ValueError('Search was not run!')
+        return make_parameters(self.assay, {**self.params,
+                                            **self.result[0]['params']})
+
+
+def set_model_defaults(assay, params):
+    """
+    Makes params default values of the widgets of the assay.
+    """
+    if assay not in MODELS:
+        raise ValueError("There is no assay '{}'!".format(assay))
+    for model in MODELS[assay]:
+        model.set_defaults(params)
+
+
+def save_parameters(params, filename):
+    """
+    Saves parameters as json, which can be read by batch --params.
+    """
+    params = {key: (list(value) if isinstance(value, tuple) else value)
+              for key, value in params.items()}
+    with open(filename, 'w') as f:
+        json.dump(params, f, indent=4)
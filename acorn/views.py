@@ -128,6 +128,8 @@ class FileManager(ImageFileMixin, FramePanel):
                                 **self.sticky_pad)
         self.widgets['save_images'].grid(row=5, column=0,
                                 sticky=tk.W, padx=5)          
+        self.widgets['preview'].grid(row=5, column=1,
+                                sticky=tk.W, padx=5)
         but_browse1.grid(row=1, column=2, **self.sticky_pad)
         but_browse2 = ttk.Button(self, text="Browse",
                                  command=self._browse_button2)
@@ -180,6 +182,11 @@ class FileManager(ImageFileMixin, FramePanel):
     def previous_file(self):
         self._previous_file()
         self.widgets['file'].set(self.current_image)
+
+    def select_file(self, index):
+        self.image_index = index
+        self.current_image = self.images[self.image_index]
+        self.widgets['file'].set(self.current_image)
                     
     def get_file_name(self, with_ext=True):
         file_name = self.widgets['file'].get()
@@ -237,6 +244,7 @@ class ImageView(tk.Frame):
                  img=None, res=(300, 200),
                  *args, **kwargs):
         super().__init__(parent, *args, **kwargs)
+        self.res = res
         self.img_button = w.ImageButton(self, img, res=res)
         self.img_button.grid(row=0, column=0, **kwargs)
         
@@ -258,6 +266,7 @@ class ImageRow(tk.Frame):
                  scales,
                  *args, **kwargs):
         super().__init__(parent, *args, **kwargs)
+        self.res = res
         self.buttons = []
         self.subtitles = subtitles
         self.sub_labels = []
@@ -306,7 +315,6 @@ class TableView(tk.Toplevel):
         self.tree['show'] = 'headings'
         self._make_columns()
         self._make_rows()
-        self._fill_table()
         scroll_y = tk.Scrollbar(self, orient=tk.VERTICAL,
                                 command=self.tree.yview)
         self.tree.configure(yscrollcommand=scroll_y.set)
@@ -324,15 +332,10 @@ class TableView(tk.Toplevel):
             self.tree.heading(col, text=col, anchor=tk.CENTER)
     
     def _make_rows(self):
-        index = 0
+        # One call of Tk for a row
         for row in self.table:
-            self.tree.insert(parent='', index=index, iid=None)
-            index += 1
-
-    def _fill_table(self):
-        for row, item in zip(self.table, self.tree.get_children()):
-            for col in self.columns:
-                self.tree.set(item=item, column=col, value=row.get(col))
+            self.tree.insert(parent='', index=tk.END,
+                             values=[row.get(col) for col in self.columns])
 
 
 class ButtonPanel:
@@ -378,6 +381,13 @@ class ButtonPanel:
                                 command=self._add_prop)
         prop_button.grid(row=3, column=1, columnspan=3,
                                 **self.sticky_pad)
+        self.sweep_button = tk.Button(self.button_frame,
+                                text='Offset Sweep',
+                                relief='groove',
+                                state='disabled',
+                                command=self._offset_sweep)
+        if getattr(self, 'sweep_label', None):
+            self.sweep_button.grid(row=3, column=4, **self.sticky_pad)
     
     def grid_button_frame(self, *args, **kwargs):
         self.button_frame.grid(*args, **kwargs)
@@ -414,6 +424,12 @@ class ButtonPanel:
     def deactivate_add_to_report(self):
         self.buttons[5].configure(state='disabled')
 
+    def activate_offset_sweep(self):
+        self.sweep_button.configure(state='normal')
+
+    def deactivate_offset_sweep(self):
+        self.sweep_button.configure(state='disabled')
+
     def activate_report_buttons(self):
         ind = [6, 7, 8]
         for i in ind:
@@ -454,6 +470,9 @@ class ButtonPanel:
     def _add_prop(self):
         pass
 
+    def _offset_sweep(self):
+        pass
+
 
 class AssayView(ButtonPanel, tk.Frame):
     """
@@ -583,8 +602,8 @@ class AssayView(ButtonPanel, tk.Frame):
         
     def set_widgets(self, widget_values):
         self.image_correction.set_widgets(widget_values)
-        if not self.additional_panel:
-            self.additional_panel.set_widgets(widget_values)
+        if self.additional_panel:
+            self.add_panel.set_widgets(widget_values)
         
     def get_images(self):
         return self.file_manager.get_images()
@@ -627,13 +646,17 @@ class AssayView(ButtonPanel, tk.Frame):
     def destroy_wait_window(self):
         self.wait_window.destroy()
 
-    def progress_widget(self):
+    def progress_widget(self, cancel=None):
+        """
+        Shows the progress window; if cancel is given,
+        it is called by the Cancel button of the window.
+        """
         self.progress_window = tk.Toplevel(self,
                                 highlightcolor='red',
                                 highlightbackground='red',
                                 highlightthickness=1)
         self.progress_window.overrideredirect(True)
-        geom = self._get_geom_pop_window(300, 100)
+        geom = self._get_geom_pop_window(300, 135 if cancel else 100)
         self.progress_window.geometry(geom)
         lab = tk.Label(self.progress_window, text='Progress...',
                                 fg='red')
@@ -648,6 +671,11 @@ class AssayView(ButtonPanel, tk.Frame):
                                            length=270, mode='determinate')
         self.progressbar.grid(row=2, column=0, sticky=tk.W+tk.E, padx=10, pady=5)
         self.progressbar['value'] = 0
+        if cancel is not None:
+            self.cancel_button = ttk.Button(self.progress_window,
+                                            text='Cancel',
+                                            command=cancel)
+            self.cancel_button.grid(row=3, column=0, pady=5)
         self.update()
         self.progress_window.focus_set()
         self.progress_window.grab_set()
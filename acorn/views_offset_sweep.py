@@ -0,0 +1,154 @@
+import queue
+import tkinter as tk
+import numpy as np
+import tkinter.messagebox as tkmessagebox
+from PIL import Image, ImageTk
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from .accessory_functions import fig2array
+from .tuning import PipelineSweep
+
+
+def plot_sweep(offsets, values, offset, points=None, ylabel='',
+               size=(5, 3.2), dpi=80):
+    """
+    Plots values against offsets and marks the chosen offset.
+    points are (offsets, values) of the whole analysis.
+    """
+    fig = Figure(figsize=size, dpi=dpi)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    ax.plot(offsets, values, color='red', label='Threshold only')
+    if points is not None and len(points[0]) > 0:
+        ax.plot(points[0], points[1], 'o', color='blue',
+                label='Whole analysis')
+    ax.axvline(offset, color='gray', linestyle=':')
+    ax.set_xlabel('Offset, %')
+    ax.set_ylabel(ylabel)
+    ax.legend(loc='best', fontsize='small')
+    fig.tight_layout()
+    return fig2array(fig)
+
+
+class OffsetSweepView(tk.Toplevel):
+    """
+    Shows wound area or confluence of the image as a function
+    of the threshold offset. 'Whole Analysis' adds points computed
+    with all steps of the analysis, 'Use Offset' passes the chosen
+    offset to the parameters of the app.
+    """
+
+    sticky_pad = {'sticky': tk.W+tk.E+tk.N+tk.S,
+                  'padx': 5, 'pady': 2}
+    poll_interval = 50 # ms
+
+    def __init__(self, parent, assay, img_path, params,
+                 offsets, values, ylabel='',
+                 *args, **kwargs):
+        super().__init__(parent, *args, **kwargs)
+        super().title('Offset Sweep')
+        super().resizable(width=False, height=False)
+        super().grab_set()
+        self.parent = parent
+        self.assay = assay
+        self.img_path = img_path
+        self.params = params
+        self.offsets = np.asarray(offsets)
+        self.values = np.asarray(values)
+        self.ylabel = ylabel
+        self.points = dict()
+        self.sweep = None
+        self.sweep_queue = queue.Queue()
+        self.plot_label = tk.Label(self)
+        self.plot_label.grid(row=0, column=0, columnspan=3,
+                             **self.sticky_pad)
+        self.offset_var = tk.DoubleVar(value=params.get('offset', 0))
+        step = self.offsets[1] - self.offsets[0]
+        scale = tk.Scale(self, variable=self.offset_var,
+                         from_=self.offsets[0], to=self.offsets[-1],
+                         resolution=step, orient=tk.HORIZONTAL,
+                         label='Offset, %', command=self._redraw)
+        scale.grid(row=1, column=0, columnspan=3, **self.sticky_pad)
+        self.value_label = tk.Label(self)
+        self.value_label.grid(row=2, column=0, columnspan=3,
+                              **self.sticky_pad)
+        self.pipeline_button = tk.Button(self, text='Whole Analysis',
+                                         relief='groove',
+                                         command=self._pipeline)
+        self.pipeline_button.grid(row=3, column=0, **self.sticky_pad)
+        use_button = tk.Button(self, text='Use Offset',
+                               relief='groove',
+                               command=self._use_offset)
+        use_button.grid(row=3, column=1, **self.sticky_pad)
+        close_button = tk.Button(self, text='Close',
+                                 relief='groove',
+                                 command=self._close)
+        close_button.grid(row=3, column=2, **self.sticky_pad)
+        self.protocol('WM_DELETE_WINDOW', self._close)
+        self._redraw()
+
+    def _redraw(self, *args):
+        offset = self.offset_var.get()
+        index = np.argmin(np.abs(self.offsets - offset))
+        text = '{}: {}%'.format(self.ylabel,
+                                round(self.values[index], 1))
+        if offset in self.points:
+            text += ' (whole analysis: {}%)'.format(
+                round(self.points[offset], 1))
+        self.value_label.configure(text=text)
+        points = None
+        if len(self.points) > 0:
+            keys = sorted(self.points)
+            points = (keys, [self.points[k] for k in keys])
+        plot = plot_sweep(self.offsets, self.values, offset,
+                          points=points, ylabel=self.ylabel + ', %')
+        self.photo = ImageTk.PhotoImage(Image.fromarray(plot))
+        self.plot_label.configure(image=self.photo)
+
+    def _pipeline(self):
+        self.pipeline_button.configure(state='disabled')
+        self.sweep_errors = []
+        self.sweep = PipelineSweep(self.assay, self.img_path, self.params)
+        self.n_parts = len(self.sweep.parts())
+        self.sweep.start(self._sweep_callback)
+        self.after(self.poll_interval, self._poll_pipeline)
+
+    def _sweep_callback(self, offsets, values, error):
+        # Called from a thread of the pool.
+        self.sweep_queue.put((offsets, values, error))
+
+    def _poll_pipeline(self):
+        if self.sweep is None:
+            return
+        while True:
+            try:
+                offsets, values, error = self.sweep_queue.get_nowait()
+            except queue.Empty:
+                break
+            self.n_parts -= 1
+            if error is None:
+                self.points.update(zip(offsets.tolist(), values))
+            else:
+                self.sweep_errors.append(str(error))
+        self._redraw()
+        if self.n_parts > 0:
+            self.after(self.poll_interval, self._poll_pipeline)
+        else:
+            self.sweep.stop()
+            self.sweep = None
+            self.pipeline_button.configure(state='normal')
+            if self.sweep_errors:
+                tkmessagebox.showerror('Error!',
+                                       '\n'.join(self.sweep_errors),
+                                       parent=self)
+
+    def _use_offset(self):
+        self.parent.set_widgets({'offset': self.offset_var.get()})
+        self._close()
+
+    def _close(self):
+        if self.sweep is not None:
+            self.sweep.stop(cancel=True)
+            self.sweep = None
+        self.destroy()
+        self.parent.grab_set()
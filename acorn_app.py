@@ -1,5 +1,7 @@
-
+from multiprocessing import freeze_support
 from acorn.main_view import AcornImage
 
-root = AcornImage()
-root.mainloop()
\ No newline at end of file
+if __name__ == '__main__':
+    freeze_support()
+    root = AcornImage()
+    root.mainloop()
@@ -0,0 +1,33 @@
+# Small crops of the sample images, so tests run fast.
+
+import os
+import pytest
+from PIL import Image
+
+SAMPLES = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'Sample Images')
+
+
+def crop(tmp_path_factory, sample, box, name):
+    path = str(tmp_path_factory.mktemp('images') / name)
+    Image.open(os.path.join(SAMPLES, sample)).crop(box).save(path)
+    return path
+
+
+@pytest.fixture(scope='session')
+def wound_image(tmp_path_factory):
+    return crop(tmp_path_factory, os.path.join('Wounds', '01.JPG'),
+                (400, 300, 800, 600), 'wound.png')
+
+
+@pytest.fixture(scope='session')
+def cells_image(tmp_path_factory):
+    return crop(tmp_path_factory,
+                os.path.join('Cells', 'Results', '04_counter_000.jpg'),
+                (0, 0, 600, 450), 'cells.png')
+
+
+@pytest.fixture(scope='session')
+def confluent_image(tmp_path_factory):
+    return crop(tmp_path_factory, os.path.join('Confluent', '01.JPG'),
+                (300, 200, 700, 500), 'confluent.png')
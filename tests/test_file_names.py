@@ -0,0 +1,82 @@
+# File names of file_namer against the names of the original
+# recursive file_namer, and unique names for concurrent writers.
+
+import os
+import threading
+import pytest
+from acorn.accessory_functions import file_namer, remove_reserved
+from acorn.accessory_functions import FileNameAllocator
+
+
+def proposed_name(folder, name, ext, num=0):
+    # The original file_namer: the first name which doesn't exist
+    while True:
+        path = os.path.join(folder, '{}_{:03d}.{}'.format(name, num, ext))
+        if not os.path.exists(path):
+            return path
+        num += 1
+
+
+def touch(folder, file_name):
+    open(os.path.join(folder, file_name), 'w').close()
+
+
+def test_file_namer_gives_the_names_of_original_file_namer(tmp_path):
+    folder = str(tmp_path)
+    for file_name in ('img_Wound_000.jpg', 'img_Wound_001.jpg',
+                      'img_Wound_004.jpg', 'img_Wound_1000.jpg',
+                      'img_Wound_002.png', 'img_000.jpg', 'other.jpg'):
+        touch(folder, file_name)
+    for num in (0, 0, 0, 3, 0, 10, 2):
+        expected = proposed_name(folder, 'img_Wound', 'jpg', num)
+        path = file_namer(folder, basename='img', suffix='Wound',
+                          num=num, ext='jpg')
+        assert path == expected
+        assert os.path.exists(path)
+    assert file_namer(folder, prefix='a_', basename='img', ext='jpg') == \
+        os.path.join(folder, 'a_img_000.jpg')
+
+
+def test_file_namer_sees_files_made_by_others(tmp_path):
+    folder = str(tmp_path)
+    assert file_namer(folder, ext='csv').endswith('file_000.csv')
+    touch(folder, 'file_001.csv')
+    touch(folder, 'file_002.csv')
+    assert file_namer(folder, ext='csv').endswith('file_003.csv')
+
+
+def test_removed_name_is_given_again(tmp_path):
+    folder = str(tmp_path)
+    paths = [file_namer(folder, ext='csv') for _ in range(3)]
+    remove_reserved(paths[1])
+    assert not os.path.exists(paths[1])
+    assert file_namer(folder, ext='csv') == paths[1]
+    # Removing a missing file is not an error
+    remove_reserved(paths[1] + '.missing')
+
+
+@pytest.mark.parametrize('n_allocators', [1, 3])
+def test_concurrent_writers_get_unique_names(tmp_path, n_allocators):
+    # Separate allocators of one folder stand for separate processes
+    folder = str(tmp_path)
+    allocators = [FileNameAllocator(folder) for _ in range(n_allocators)]
+    n_threads, n_names = 8, 40
+    names = [[] for _ in range(n_threads)]
+    start = threading.Barrier(n_threads)
+
+    def allocate(index):
+        allocator = allocators[index % n_allocators]
+        start.wait()
+        for _ in range(n_names):
+            names[index].append(allocator('img', 'jpg'))
+
+    threads = [threading.Thread(target=allocate, args=(index,))
+               for index in range(n_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    paths = [path for thread_names in names for path in thread_names]
+    assert len(set(paths)) == len(paths) == n_threads * n_names
+    assert sorted(os.listdir(folder)) == \
+        ['img_{:03d}.jpg'.format(num) for num in range(len(paths))]
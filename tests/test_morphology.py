@@ -0,0 +1,89 @@
+# Distance transform morphology and ComponentFilter against
+# skimage.
+
+import numpy as np
+import pytest
+from scipy import ndimage as ndi
+from skimage.morphology import binary_dilation, binary_erosion
+from skimage.morphology import binary_closing, binary_opening, disk
+from skimage.morphology import remove_small_objects
+from acorn.morphology import dilation, erosion, closing, opening
+from acorn.morphology import ComponentFilter
+
+
+def blobs(seed=0, shape=(120, 150)):
+    rng = np.random.default_rng(seed)
+    img = ndi.gaussian_filter(rng.random(shape), 2) > 0.5
+    # Objects and holes touch the borders of the image
+    img[:5] = True
+    img[:, -4:] = False
+    return img
+
+
+@pytest.mark.parametrize('radius', [1, 3, 7, 12])
+def test_edt_dilation_and_erosion_equal_skimage(radius):
+    img = blobs()
+    assert np.array_equal(dilation(img, radius),
+                          binary_dilation(img, disk(radius)))
+    assert np.array_equal(erosion(img, radius),
+                          binary_erosion(img, disk(radius)))
+
+
+@pytest.mark.parametrize('method', ['edt', 'footprint'])
+@pytest.mark.parametrize('radius', [1, 3, 7, 12])
+def test_closing_and_opening_equal_skimage(method, radius):
+    img = blobs(radius)
+    assert np.array_equal(closing(img, radius, method),
+                          binary_closing(img, disk(radius)))
+    assert np.array_equal(opening(img, radius, method),
+                          binary_opening(img, disk(radius)))
+
+
+def test_empty_and_full_images():
+    for img in (np.zeros((20, 30), bool), np.ones((20, 30), bool)):
+        for radius in (2, 9):
+            assert np.array_equal(closing(img, radius, 'edt'),
+                                  binary_closing(img, disk(radius)))
+            assert np.array_equal(opening(img, radius, 'edt'),
+                                  binary_opening(img, disk(radius)))
+
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        closing(blobs(), 3, 'fft')
+
+
+def free_size(img, size):
+    """
+    Returns the smallest size from size on which no component
+    of img has: skimage versions differ in removing components
+    of exactly min_size pixels.
+    """
+    sizes = set(np.bincount(ndi.label(img)[0].ravel())[1:].tolist())
+    while size in sizes:
+        size += 1
+    return size
+
+
+def remove_grains(img, object_size, hole_size):
+    # Two calls of remove_small_objects, as WoundImage made them
+    object_size = free_size(img, object_size)
+    img = remove_small_objects(img, min_size=object_size)
+    holes = np.logical_not(img)
+    hole_size = free_size(holes, hole_size)
+    return object_size, hole_size, remove_small_objects(holes,
+                                                        min_size=hole_size)
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_component_filter_equals_remove_small_objects(seed):
+    img = blobs(seed)
+    components = ComponentFilter(img)
+    for object_size, hole_size in ((1, 1), (10, 5), (30, 60),
+                                   (80, 20), (400, 400)):
+        object_size, hole_size, expected = remove_grains(img, object_size,
+                                                         hole_size)
+        result = components(object_size, hole_size)
+        assert np.array_equal(result, expected)
+        assert components.area(object_size, hole_size) == \
+            np.count_nonzero(expected)
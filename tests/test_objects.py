@@ -0,0 +1,41 @@
+# Object table of CellCounter against skimage regionprops.
+
+import numpy as np
+import pytest
+from skimage.measure import regionprops
+from acorn.image_analysis import CellCounter
+
+COUNTER = {'channel': 'Green', 'binary_filter': 'Minimum',
+           'mask_filter': 'Otsu', 'min_dist': 3, 'disk_radius': 3,
+           'size_thresh': 25}
+
+
+@pytest.mark.parametrize('max_size', [None, (300, 300)])
+def test_object_table_equals_regionprops(cells_image, max_size):
+    counter = CellCounter(cells_image, max_size=max_size)
+    counter(**COUNTER)
+    table = counter.get_object_table()
+    scale = counter.scale
+    regions = regionprops(counter.img_labeled,
+                          intensity_image=counter.binary_im.img_corrected)
+    assert len(regions) > 0
+    assert np.array_equal(table['label'], [r.label for r in regions])
+    area = np.array([r.area for r in regions])
+    np.testing.assert_allclose(table['area'], area / scale**2)
+    centroid = np.array([r.centroid for r in regions])
+    np.testing.assert_allclose(table['centroid_row'], centroid[:, 0] / scale)
+    np.testing.assert_allclose(table['centroid_col'], centroid[:, 1] / scale)
+    bbox = np.array([r.bbox for r in regions])
+    for column, key in enumerate(('min_row', 'min_col',
+                                  'max_row', 'max_col')):
+        np.testing.assert_allclose(table[key], bbox[:, column] / scale)
+    np.testing.assert_allclose(table['equivalent_diameter'],
+                               [r.equivalent_diameter / scale
+                                for r in regions])
+    np.testing.assert_allclose(table['mean_intensity'],
+                               [r.intensity_mean for r in regions])
+    integrated = np.array([r.intensity_image.sum() for r in regions])
+    np.testing.assert_allclose(table['integrated_intensity'],
+                               integrated / scale**2)
+    size_thresh = counter.binary_im.scaled(COUNTER['size_thresh'], 2)
+    assert np.array_equal(table['cell'], area >= size_thresh)
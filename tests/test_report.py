@@ -0,0 +1,223 @@
+# Reports against the rows read back from their csv files and
+# against reports kept as lists of rows.
+
+import os
+import csv
+import random
+import numpy as np
+import pytest
+from acorn.accessory_functions import format_row, read_csv, save_csv
+from acorn.report import Report, ReportWriter
+
+FIELDS = ['file', 'channel', 'offset', 'N_cells', 'confl']
+STATS = ['N_cells', 'confl']
+
+
+def make_rows(n):
+    return [{'file': 'images/{:02d}.jpg'.format(i),
+             'channel': 'Green', 'offset': i % 3 - 1.5,
+             'N_cells': 10 * i, 'confl': i / 7}
+            for i in range(n)]
+
+
+def test_writer_rows_equal_formatted_rows(tmp_path):
+    filename = str(tmp_path / 'report.csv')
+    rows = make_rows(5)
+    with ReportWriter(filename, fsync_every=2) as writer:
+        for row in rows:
+            writer.append(row)
+        # Rows are in the file before the writer is closed
+        assert read_csv(filename) == [format_row(row) for row in rows]
+    assert read_csv(filename) == [format_row(row) for row in rows]
+
+
+def test_writer_resumes_after_a_crash(tmp_path):
+    filename = str(tmp_path / 'report.csv')
+    rows = make_rows(6)
+    with ReportWriter(filename) as writer:
+        for row in rows[:4]:
+            writer.append(row)
+    # The last row was cut while it was written
+    with open(filename, 'rb+') as f:
+        f.truncate(os.path.getsize(filename) - 5)
+    with ReportWriter(filename, fieldnames=FIELDS, resume=True) as writer:
+        for row in rows[:3]:
+            params = {'channel': row['channel'], 'offset': row['offset'],
+                      'unknown': 1}
+            assert writer.contains(row['file'], params)
+        assert not writer.contains(rows[3]['file'], {})
+        assert not writer.contains(rows[0]['file'], {'offset': 100})
+        for row in rows[3:]:
+            writer.append(row)
+    assert read_csv(filename) == [format_row(row) for row in rows]
+
+
+def test_writer_refuses_other_columns(tmp_path):
+    filename = str(tmp_path / 'report.csv')
+    with ReportWriter(filename) as writer:
+        writer.append(make_rows(1)[0])
+        with pytest.raises(ValueError):
+            writer.append({'file': 'a.jpg', 'N_cells': 1})
+    with pytest.raises(ValueError):
+        ReportWriter(filename, fieldnames=['file', 'N_cells'], resume=True)
+
+
+def test_writer_saves_npz_columns(tmp_path):
+    filename = str(tmp_path / 'report.csv')
+    rows = make_rows(4)
+    with ReportWriter(filename, npz=True) as writer:
+        for row in rows:
+            writer.append(row)
+    columns = np.load(str(tmp_path / 'report.npz'))
+    assert sorted(columns.files) == sorted(FIELDS)
+    assert list(columns['file']) == [format_row(row)['file'] for row in rows]
+    assert list(columns['channel']) == ['Green'] * 4
+    for key in ('offset', 'N_cells', 'confl'):
+        np.testing.assert_allclose(columns[key], [row[key] for row in rows])
+
+
+def same_value(a, b, stat=False):
+    if stat and a != a and b != b:
+        return True
+    if isinstance(a, bool) or isinstance(b, bool):
+        return type(a) == type(b) and a == b
+    return a == b
+
+
+def is_duplicate(rows, row):
+    # The last row of the file and parameters is searched in the list
+    for old in reversed(rows):
+        if all(same_value(old[key], row[key])
+               for key in row if key not in STATS):
+            return all(same_value(old[key], row[key], stat=True)
+                       for key in STATS)
+    return False
+
+
+def random_rows(n, seed=0):
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(n):
+        rows.append({'file': rng.choice(['a.jpg', 'b.jpg', 'c.jpg']),
+                     'channel': rng.choice(['Green', 'Red']),
+                     'offset': rng.choice([6, 6.0, 0, -1.5, True]),
+                     'N_cells': rng.choice([1, 2]),
+                     'confl': rng.choice([0.5, float('nan')])})
+    return rows
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_report_adds_rows_as_list_of_rows(seed):
+    report = Report(STATS)
+    expected = []
+    for row in random_rows(300, seed):
+        duplicate = is_duplicate(expected, row)
+        assert (row in report) == duplicate
+        assert report.append(row) != duplicate
+        if not duplicate:
+            expected.append(row)
+    assert len(report) == len(expected)
+    for result, row in zip(report, expected):
+        assert result.keys() == row.keys()
+        assert all(same_value(result[key], row[key], stat=True)
+                   for key in row)
+    for index in (0, 7, -1):
+        assert report[index]['file'] == expected[index]['file']
+    for img_path in ('a.jpg', 'b.jpg', 'c.jpg'):
+        last = [row for row in expected if row['file'] == img_path][-1]
+        assert report.find(img_path)['N_cells'] == last['N_cells']
+    assert report.find('d.jpg') is None
+
+
+def test_report_replaces_last_row_of_file():
+    rows = make_rows(3)
+    report = Report(STATS, rows)
+    row = dict(rows[1], N_cells=99)
+    assert report.replace(row)
+    assert not report.replace(row)
+    assert len(report) == 3
+    assert report[1] == row
+    assert rows[1] not in report
+    assert report.replace(dict(rows[1], file='new.jpg'))
+    assert len(report) == 4
+
+
+def test_report_refuses_other_columns():
+    rows = make_rows(2)
+    report = Report(STATS, rows)
+    row = {'file': rows[0]['file'], 'N_cells': 1}
+    for method in (report.append, report.replace, report.__contains__):
+        with pytest.raises(ValueError):
+            method(row)
+    assert len(report) == 2
+
+
+def original_save_csv(table, fieldnames, filename):
+    # save_csv of the list of rows before the columnar report
+    with open(filename, "w", newline="") as csvfile:
+        writer = csv.DictWriter(csvfile, delimiter=";",
+                                fieldnames=fieldnames)
+        writer.writeheader()
+        for row in table:
+            row = dict(row)
+            for key in row.keys():
+                if key == 'file':
+                    row[key] = row[key].replace('/', '\\')
+                else:
+                    row[key] = str(row[key]).replace('.', ',')
+            writer.writerow(row)
+
+
+def mixed_rows(n, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for i in range(n):
+        rows.append({'file': 'C:/images/{}.{}.jpg'.format(i, i % 4),
+                     'channel': ['Green', 'Red', 'Blue'][i % 3],
+                     'binary_filter': 'Minimum',
+                     'offset': [0, 1.5, -2, 2.25][i % 4],
+                     'min_dist': None if i % 5 else 3,
+                     'equal_exposure': bool(i % 2),
+                     'N_cells': int(rng.integers(0, 1000)),
+                     'mean_cell_size': round(float(rng.random() * 100), 2),
+                     'sd_cell_size': np.float64(rng.random()),
+                     'confl': float('nan') if i % 7 == 0 else
+                     float(rng.random())})
+    return rows
+
+
+@pytest.mark.parametrize('reorder', [False, True])
+def test_report_csv_equals_original_save_csv(tmp_path, reorder):
+    rows = mixed_rows(50)
+    report = Report(['N_cells', 'mean_cell_size', 'sd_cell_size', 'confl'],
+                    rows)
+    fieldnames = list(rows[0])
+    if reorder:
+        fieldnames = fieldnames[::-1]
+    expected = str(tmp_path / 'expected.csv')
+    original_save_csv(rows, fieldnames, expected)
+    for name, save in (('report.csv',
+                        lambda f: report.save_csv(f, fieldnames)),
+                       ('rows.csv',
+                        lambda f: save_csv(list(report), fieldnames, f))):
+        filename = str(tmp_path / name)
+        save(filename)
+        with open(filename, 'rb') as f, open(expected, 'rb') as g:
+            assert f.read() == g.read()
+    if not reorder:
+        report.save_csv(str(tmp_path / 'default.csv'))
+        with open(str(tmp_path / 'default.csv'), 'rb') as f, \
+                open(expected, 'rb') as g:
+            assert f.read() == g.read()
+
+
+def test_report_columns_equal_rows():
+    rows = mixed_rows(20)
+    report = Report(['N_cells', 'confl'], rows)
+    columns = report.as_columns()
+    assert sorted(columns) == sorted(rows[0])
+    for key, values in columns.items():
+        assert len(values) == len(rows)
+        for value, row in zip(values, rows):
+            assert same_value(value, row[key], stat=True) or \
+                str(value) == str(row[key])
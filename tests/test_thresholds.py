@@ -0,0 +1,59 @@
+# HistogramThreshold against the skimage threshold functions
+# it replaces.
+
+import numpy as np
+import pytest
+from skimage.filters import threshold_mean, threshold_otsu
+from skimage.filters import threshold_minimum
+from acorn.accessory_functions import HistogramThreshold
+
+
+def bimodal(dtype, seed=0):
+    rng = np.random.default_rng(seed)
+    img = np.concatenate((rng.normal(70, 12, 30000),
+                          rng.normal(170, 20, 20000)))
+    img = np.clip(img, 0, 255).reshape(200, 250)
+    if dtype == np.uint8:
+        return img.astype(np.uint8)
+    return img / 255
+
+
+REFERENCES = {'Mean': threshold_mean,
+              'Otsu': threshold_otsu,
+              'Minimum': threshold_minimum}
+
+
+@pytest.mark.parametrize('dtype', [np.uint8, float])
+@pytest.mark.parametrize('filt', sorted(REFERENCES))
+def test_thresholds_equal_skimage(dtype, filt):
+    img = bimodal(dtype)
+    expected = REFERENCES[filt](img)
+    assert HistogramThreshold(img)(filt) == pytest.approx(expected)
+
+
+def test_thresholds_of_accumulated_histogram():
+    img = bimodal(np.uint8)
+    counts = np.bincount(img.ravel(), minlength=256)
+    histogram = HistogramThreshold.from_histogram(
+        counts, np.arange(256), img.mean(), np.uint8)
+    for filt, reference in REFERENCES.items():
+        assert histogram(filt) == pytest.approx(reference(img))
+
+
+@pytest.mark.parametrize('dtype', [np.uint8, float])
+def test_percent_binary(dtype):
+    img = bimodal(dtype)
+    histogram = HistogramThreshold(img)
+    thresholds = np.quantile(img, [0, 0.1, 0.5, 0.9, 1])
+    above = [np.count_nonzero(img > t) * 100 / img.size
+             for t in thresholds]
+    below = [np.count_nonzero(img < t) * 100 / img.size
+             for t in thresholds]
+    assert histogram.percent_binary(thresholds) == pytest.approx(above)
+    assert histogram.percent_binary(thresholds, below=True) == \
+        pytest.approx(below)
+
+
+def test_unknown_filter():
+    with pytest.raises(ValueError):
+        HistogramThreshold(bimodal(np.uint8))('Median')
@@ -0,0 +1,107 @@
+# Tiled analysis against the analysis of the whole image.
+
+import numpy as np
+import pytest
+from PIL import Image
+from scipy import ndimage as ndi
+from acorn.batch import make_parameters, analyse_image, BatchAnalysis
+from acorn.image_analysis import CellCounter
+from acorn.tiling import StitchedLabels, TiledImage
+from acorn.tiling import TiledWoundImage, TiledCellConfluent
+from acorn.tiling import TiledCellCounter
+
+COUNTER = {'channel': 'Green', 'binary_filter': 'Minimum',
+           'mask_filter': 'Otsu', 'min_dist': 3, 'disk_radius': 3,
+           'size_thresh': 25}
+
+
+def test_stitched_labels_equal_labels_of_the_image():
+    rng = np.random.default_rng(0)
+    img = ndi.gaussian_filter(rng.random((100, 130)), 3) > 0.5
+    tiled = TiledImage(img.astype(np.uint8), tile_size=32)
+    objects = StitchedLabels(len(tiled.tiles))
+    for index, (y0, y1, x0, x1) in enumerate(tiled.tiles):
+        objects.add(index, *ndi.label(img[y0:y1, x0:x1]))
+    objects.join(tiled._neighbours())
+    labels, n_labels = ndi.label(img)
+    sizes = np.bincount(labels.ravel())
+    assert sorted(objects.sizes[1:]) == sorted(sizes[1:])
+    for index, (y0, y1, x0, x1) in enumerate(tiled.tiles):
+        tile_labels = ndi.label(img[y0:y1, x0:x1])[0]
+        assert np.array_equal(objects.object_sizes(index, tile_labels),
+                              sizes[labels[y0:y1, x0:x1]] * img[y0:y1,
+                                                                x0:x1])
+
+
+@pytest.mark.parametrize('assay, tiled_analyzer',
+                         [('wound', TiledWoundImage),
+                          ('confluent', TiledCellConfluent)])
+@pytest.mark.parametrize('tile_size', [64, 136])
+def test_tiled_area_equals_the_whole_image(assay, tiled_analyzer,
+                                           tile_size, wound_image,
+                                           confluent_image):
+    img_path = wound_image if assay == 'wound' else confluent_image
+    params = make_parameters(assay, {'equal_exposure': False})
+    image = tiled_analyzer(img_path, tile_size=tile_size)
+    out = np.zeros((image.height, image.width), dtype=bool)
+    image(out=out, **params)
+    image.check(tolerance=0)
+    whole = image.analyzer(img_path)
+    whole(**params)
+    # Both analyzers keep the wound (space between cells) in img_binary
+    assert np.array_equal(out, whole.img_binary)
+
+
+def test_tiled_image_reads_npy(tmp_path, wound_image):
+    path = str(tmp_path / 'wound.npy')
+    np.save(path, np.asarray(Image.open(wound_image)))
+    params = make_parameters('wound', {'equal_exposure': False})
+    from_npy = TiledWoundImage(path, tile_size=64)
+    from_npy(**params)
+    from_file = TiledWoundImage(wound_image, tile_size=64)
+    from_file(**params)
+    assert from_npy.get_report_stat() == from_file.get_report_stat()
+
+
+def test_batch_rows_of_tiled_images(wound_image):
+    params = make_parameters('wound', {'equal_exposure': False})
+    assert analyse_image('wound', wound_image, params, tile_size=64) == \
+        analyse_image('wound', wound_image, params)
+    # Equal exposure needs the whole image
+    batch = BatchAnalysis('wound', {'equal_exposure': True}, tile_size=64)
+    assert batch.tile_size is None
+
+
+def test_equal_exposure_is_not_tiled(wound_image):
+    image = TiledWoundImage(wound_image, tile_size=64)
+    with pytest.raises(ValueError):
+        image(**make_parameters('wound', {'equal_exposure': True}))
+
+
+@pytest.mark.parametrize('tile_size', [128, 200])
+def test_tiled_counts_within_tolerance(tile_size, cells_image):
+    image = TiledCellCounter(cells_image, tile_size=tile_size)
+    out = np.zeros((image.height, image.width), dtype=np.int64)
+    image(out=out, **COUNTER)
+    image.check()
+    whole = CellCounter(cells_image)
+    whole(**COUNTER)
+    assert image.N_objects == whole.N_objects
+    # Labels differ only where equally deep basins meet
+    differ = np.count_nonzero(out != whole.img_labeled)
+    assert differ <= 0.01 * np.count_nonzero(whole.img_binary_mask)
+
+
+def test_fragments_are_joined_to_their_cells(cells_image):
+    # A small halo leaves parts of cells without markers in windows
+    image = TiledCellCounter(cells_image, tile_size=64)
+    out = np.zeros((image.height, image.width), dtype=np.int64)
+    image(halo=32, out=out, **COUNTER)
+    sizes = np.bincount(out.ravel(), minlength=len(image.label_sizes))
+    assert np.array_equal(sizes[1:], image.label_sizes[1:])
+    whole = CellCounter(cells_image)
+    whole(**COUNTER)
+    mask = whole.img_binary_mask
+    # Only watershed lines and components without markers are left
+    assert np.count_nonzero(mask & (out == 0)) == pytest.approx(
+        np.count_nonzero(mask & (whole.img_labeled == 0)), rel=0.02)
@@ -0,0 +1,61 @@
+# Offset sweep and parameter search against separate analyses
+# of every offset and parameter combination.
+
+import numpy as np
+import pytest
+from acorn.batch import make_parameters
+from acorn.image_analysis import BinaryImage, WoundImage
+from acorn.tuning import offset_sweep, ParameterSearch
+from acorn.tuning import predicted_mask, reference_error
+
+WOUND = {'disk_radius': 4, 'filt': 'Mean', 'mode': 'Borders',
+         'equal_exposure': False}
+
+
+@pytest.mark.parametrize('assay', ['wound', 'confluent'])
+def test_offset_sweep_equals_thresholding(assay, wound_image,
+                                          confluent_image):
+    img_path = wound_image if assay == 'wound' else confluent_image
+    params = make_parameters(assay, {'equal_exposure': False})
+    offsets, areas = offset_sweep(assay, img_path, params,
+                                  offsets=[-20, -5, 0, 5, 20])
+    image = BinaryImage(img_path)
+    image(**params)
+    for offset, area in zip(offsets, areas):
+        binary = image.binarize(params['filt'], params['mode'], offset)[1]
+        expected = np.count_nonzero(binary) * 100 / binary.size
+        if assay == 'wound':
+            expected = 100 - expected
+        assert area == pytest.approx(expected)
+
+
+def test_search_errors_equal_separate_analyses(wound_image):
+    params = make_parameters('wound', {**WOUND, 'offset': 0.0})
+    image = WoundImage(wound_image)
+    image(**params)
+    reference = predicted_mask('wound', image)
+    grid = {'offset': [-5.0, 0.0, 5.0], 'disk_radius': [2, 4]}
+    search = ParameterSearch('wound', {wound_image: reference}, grid,
+                             params=WOUND, max_workers=2)
+    result = search()
+    assert len(result) == 6
+    assert result[0]['params'] == {'offset': 0.0, 'disk_radius': 4}
+    assert result[0]['error'] == 0
+    for row in result:
+        image = WoundImage(wound_image)
+        image(**make_parameters('wound', {**WOUND, **row['params']}))
+        assert row['error'] == pytest.approx(
+            reference_error('wound', image, reference))
+    assert search.best()['disk_radius'] == 4
+
+
+def test_random_combinations_are_a_sorted_subset():
+    grid = {'disk_radius': [2, 4, 6], 'offset': [-5, 0, 5],
+            'filt': ['Mean', 'Otsu']}
+    search = ParameterSearch('wound', {}, grid, n_random=7, seed=1)
+    combinations = search.combinations()
+    everything = ParameterSearch('wound', {}, grid).combinations()
+    assert len(combinations) == 7
+    assert all(c in everything for c in combinations)
+    positions = [everything.index(c) for c in combinations]
+    assert positions == sorted(positions)